@@ -0,0 +1,286 @@
+import os
+import posixpath
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from collections import defaultdict
+from queue import Empty
+import wx.adv
+
+from compress_logic import get_worker_pool, get_function_exec, create_compression_tasks, get_output_roots, \
+    get_task_output_paths, create_log_entries, discard_worker_pool, drain_queue, TaskSupervisor, TaskFailure, \
+    POOL_SIZE, quarantined_sources
+from helpers import is_supported_file, log_to_console, create_log_file, extract_channel_number, \
+    collect_multi_frame_tiff_groups, CHANNEL_FILE_PATTERN
+
+ZIP_EXTENSIONS = ('.zip',)
+# Longest suffixes first, '.tar.gz' must not be taken for '.gz'
+TAR_WRITE_MODES = [('.tar.gz', 'w:gz'), ('.tgz', 'w:gz'), ('.tar.bz2', 'w:bz2'), ('.tbz2', 'w:bz2'),
+                   ('.tar.xz', 'w:xz'), ('.txz', 'w:xz'), ('.tar', 'w')]
+ARCHIVE_EXTENSIONS = ZIP_EXTENSIONS + tuple(extension for extension, _ in TAR_WRITE_MODES)
+ARCHIVE_WILDCARD = "Archives (*.zip;*.tar;*.tar.gz;*.tgz;*.tar.bz2;*.tar.xz)|*.zip;*.tar;*.tar.gz;*.tgz;*.tar.bz2;*.tar.xz"
+# Members spooled to scratch space ahead of the workers, bounds the disk used by a run from an archive
+MAX_TASKS_AHEAD = POOL_SIZE * 4
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+def is_archive(path):
+    return bool(path) and path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def is_safe_member_name(name):
+    # Members are spooled below the scratch directory, absolute paths and '..' must not escape it
+    normalized = posixpath.normpath(name)
+    return not (posixpath.isabs(normalized) or normalized == '..' or normalized.startswith('../'))
+
+
+class ArchiveReader:
+    """Sequential reader of a zip or tar archive, members are copied out one at a time."""
+
+    def __init__(self, archive_path):
+        self.is_zip = zipfile.is_zipfile(archive_path)
+        # 'r:*' detects the tar compression, members of a compressed tar are read in archive order
+        self.archive = zipfile.ZipFile(archive_path) if self.is_zip else tarfile.open(archive_path, 'r:*')
+
+    def members(self):
+        # (member, relative path) of every regular file, in archive order
+        if self.is_zip:
+            entries = ((info, info.filename) for info in self.archive.infolist() if not info.is_dir())
+        else:
+            entries = ((info, info.name) for info in self.archive if info.isfile())
+        for member, name in entries:
+            if is_safe_member_name(name):
+                yield member, posixpath.normpath(name)
+
+    def spool(self, member, file_path):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        source = self.archive.open(member) if self.is_zip else self.archive.extractfile(member)
+        with source, open(file_path, 'wb') as spooled_file:
+            shutil.copyfileobj(source, spooled_file, SPOOL_CHUNK_SIZE)
+
+    def close(self):
+        self.archive.close()
+
+
+class ArchiveWriter:
+    """Output archive, files are appended as their task finishes."""
+
+    def __init__(self, archive_path):
+        if archive_path.lower().endswith(ZIP_EXTENSIONS):
+            # Images are already compressed, deflating them again only costs time
+            self.archive = zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        else:
+            mode = next(mode for extension, mode in TAR_WRITE_MODES if archive_path.lower().endswith(extension))
+            self.archive = tarfile.open(archive_path, mode)
+
+    def add(self, file_path, arcname):
+        if isinstance(self.archive, zipfile.ZipFile):
+            self.archive.write(file_path, arcname)
+        else:
+            self.archive.add(file_path, arcname)
+
+    def close(self):
+        self.archive.close()
+
+
+def list_archive_members(archive_path):
+    reader = ArchiveReader(archive_path)
+    try:
+        return [name for _, name in reader.members()]
+    finally:
+        reader.close()
+
+
+def count_files_in_archive(archive_path, console_output, is_cancel_requested=None):
+    # Same figures as count_files_in_source plus the member names, listed in one pass over the archive.
+    # A compressed tar is read to its end to list it, so cancel is checked member by member.
+    supported_extensions = ['.png', '.jpg', '.jpeg', '.tif', '.tiff', '.webp', '.bmp', '.dib']
+    total_files = 0
+    unsupported_files = []
+    member_names = []
+    log_to_console(console_output, "========================================", None, False)
+    reader = ArchiveReader(archive_path)
+    try:
+        for _, name in reader.members():
+            if is_cancel_requested and is_cancel_requested():
+                return None
+            member_names.append(name)
+            total_files += 1
+            file = posixpath.basename(name)
+            if is_supported_file(file):
+                log_to_console(console_output, f'[*] File {total_files}: {name}', wx.GREEN, False)
+            else:
+                log_to_console(console_output, f'[!] Unsupported File {total_files}: {name}', wx.RED, False)
+                unsupported_files.append(file)
+    finally:
+        reader.close()
+    return (total_files, supported_extensions, len(unsupported_files), unsupported_files), member_names
+
+
+def collect_archive_channel_groups(member_names):
+    # Same grouping as collect_multi_frame_tiff_groups, on relative member paths
+    groups = defaultdict(list)
+    for name in member_names:
+        filename = posixpath.basename(name)
+        if filename.lower().endswith('.tif'):
+            match = CHANNEL_FILE_PATTERN.match(filename)
+            if match:
+                groups[match.group(1)].append(name)
+    return {base: sorted(names, key=extract_channel_number) for base, names in groups.items() if len(names) > 1}
+
+
+def run_archive_compression(compression_option, source, destination, console_output, is_stop_requested,
+                            should_merge, execution_engine='Auto', verify_lossless_outputs=False, member_names=None):
+    """run_compression for a source and/or destination that is a zip/tar archive instead of a directory."""
+    widths = [95, 20, 20, 20]  # Column widths
+    header = ["File Name", "Original Size (MB)", "New Size (MB)", "Saved Size (MB)"]
+    MSG_START_COMPRESSION = f"[▶] Compression with: {compression_option}!\n"
+    log_to_console(console_output, MSG_START_COMPRESSION, None, True)
+    quarantined_sources.clear()
+
+    # Member sizes are not known before spooling, so 'Auto' falls back to processes like watch mode
+    engine = 'Threads' if execution_engine == 'Threads' else 'Processes'
+    queue = get_worker_pool(engine)[1]
+    drain_queue(queue)
+    scratch_directory = tempfile.mkdtemp(prefix="smartimageshrink_archive_")
+    source_is_archive = is_archive(source)
+    source_root = os.path.join(scratch_directory, 'source') if source_is_archive else source
+    # Outputs go to the destination directory, or to scratch space until they are appended to the archive
+    destination_root = os.path.join(scratch_directory, 'destination') if is_archive(destination) else destination
+    writer = ArchiveWriter(destination) if is_archive(destination) else None
+    # Spooled member -> number of tasks still reading it, channel files feed both their merge and their own task
+    pending_readers = {}
+
+    def release_inputs(task):
+        files = task[0] if isinstance(task[0], list) else [task[0]]
+        for file_path in files:
+            if file_path not in pending_readers:
+                continue
+            pending_readers[file_path] -= 1
+            if not pending_readers[file_path]:
+                del pending_readers[file_path]
+                os.remove(file_path)
+
+    def on_task_done(task, result):
+        if source_is_archive:
+            release_inputs(task)
+        if writer is None:
+            return
+        merge = isinstance(task[0], list)
+        for output_path in get_task_output_paths(task, compression_option, merge):
+            if not os.path.exists(output_path):
+                continue
+            if not isinstance(result, TaskFailure):
+                writer.add(output_path, os.path.relpath(output_path, destination_root).replace(os.sep, '/'))
+            os.remove(output_path)
+
+    supervisor = TaskSupervisor(engine, on_task_done)
+
+    def submit(files, merge):
+        first_file = files[0][0] if merge else files[0]
+        rel_dir = os.path.relpath(os.path.dirname(first_file), source_root)
+        for output_root in get_output_roots(destination_root, compression_option):
+            os.makedirs(os.path.join(output_root, rel_dir), exist_ok=True)
+        for task in create_compression_tasks(files, source_root, destination_root, compression_option, queue,
+                                             widths, merge=merge, verify=verify_lossless_outputs):
+            supervisor.submit(get_function_exec(compression_option, merge), task)
+
+    def wait_for_tasks(max_in_flight):
+        while len(supervisor.in_flight) > max_in_flight:
+            if is_stop_requested():
+                return False
+            try:
+                log_to_console(console_output, queue.get(timeout=0.5), wx.GREEN, True)
+            except Empty:
+                pass
+            supervisor.poll()
+            for failure in supervisor.pop_unreported_failures():
+                log_to_console(console_output, f"[✖] {failure.name} - {failure.error}", wx.RED, True)
+        return True
+
+    skipped_files = []
+    reader = ArchiveReader(source) if source_is_archive else None
+    completed = False
+    try:
+        if source_is_archive:
+            log_to_console(console_output, f'[*] Streaming the members of {source} to the workers', None, True)
+            # A group is merged once all of its channels were spooled, the archive is not unpacked as a whole.
+            # The member list comes from the source scan, the archive is only listed here when it is missing.
+            if not should_merge:
+                member_names = []
+            elif member_names is None:
+                member_names = list_archive_members(source)
+            group_of_member = {}
+            groups_waiting = {}
+            for base, names in collect_archive_channel_groups(member_names).items():
+                groups_waiting[base] = set(names)
+                group_of_member.update((name, base) for name in names)
+            group_paths = defaultdict(list)
+            for member, name in reader.members():
+                if not wait_for_tasks(MAX_TASKS_AHEAD) or is_stop_requested():
+                    break
+                if not is_supported_file(name):
+                    skipped_files.append(posixpath.basename(name))
+                    continue
+                file_path = os.path.join(source_root, *name.split('/'))
+                reader.spool(member, file_path)
+                base = group_of_member.get(name)
+                pending_readers[file_path] = 2 if base else 1
+                submit([file_path], merge=False)
+                if base:
+                    group_paths[base].append(file_path)
+                    groups_waiting[base].discard(name)
+                    if not groups_waiting[base]:
+                        submit([sorted(group_paths.pop(base), key=extract_channel_number)], merge=True)
+        else:
+            # Directory into an archive: the same tasks as run_compression, outputs leave scratch space as they finish
+            grouped_files = list(collect_multi_frame_tiff_groups(source).values()) if should_merge else []
+            supported_files = []
+            for root, _, files in os.walk(source):
+                for file in files:
+                    if is_supported_file(file):
+                        supported_files.append(os.path.join(root, file))
+                    else:
+                        skipped_files.append(file)
+            for files, merge in [(group, True) for group in grouped_files] + [(file, False) for file in supported_files]:
+                if not wait_for_tasks(MAX_TASKS_AHEAD) or is_stop_requested():
+                    break
+                submit([files], merge=merge)
+        completed = wait_for_tasks(0) and not is_stop_requested()
+    finally:
+        if reader:
+            reader.close()
+        supervisor.close()
+        if not completed:
+            discard_worker_pool(engine)
+            if writer:
+                writer.close()
+            shutil.rmtree(scratch_directory, ignore_errors=True)
+    if not completed:
+        return "STOPPED"
+
+    while True:
+        try:
+            log_to_console(console_output, queue.get_nowait(), wx.GREEN, True)
+        except Empty:
+            break
+    log_entries, num_files_processed, total_saved_size = create_log_entries(supervisor.results, skipped_files, widths)
+    if skipped_files:
+        skipped_msg = f"[⚠] {len(skipped_files)} files were not processed (unsupported extensions) - {', '.join(skipped_files)}"
+        log_to_console(console_output, skipped_msg, wx.RED, True)
+    MSG_COMPRESSION_ENDED = f'Compression ended\n✅Successfully compressed {num_files_processed} images.\n '
+    log_to_console(console_output, MSG_COMPRESSION_ENDED, wx.GREEN, True)
+    log_to_console(console_output, "========================================\n", None, False)
+    try:
+        os.makedirs(destination_root, exist_ok=True)
+        log_file_path = create_log_file(destination_root, num_files_processed, log_entries, total_saved_size,
+                                        header, widths)
+        if writer:
+            writer.add(log_file_path, "log.txt")
+            writer.close()
+            # The archive holds its own log.txt, this copy is the one the completion dialog opens
+            log_file_path = shutil.move(log_file_path, destination + ".log.txt")
+    finally:
+        shutil.rmtree(scratch_directory, ignore_errors=True)
+    return log_file_path
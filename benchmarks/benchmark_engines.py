@@ -0,0 +1,84 @@
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import freeze_support
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compress_logic import create_compression_tasks, create_progress_queue, create_pool, choose_execution_engine, \
+    copy_source_directory_tree, process_file, merge_tiffs, POOL_SIZE
+from helpers import collect_multi_frame_tiff_groups
+
+# Times both execution engines on synthetic workloads and reports which one wins, compare with what 'Auto' picks.
+# Usage: python benchmarks/benchmark_engines.py
+
+COMPRESSION_OPTION = 'Compress Size x2'
+WIDTHS = [95, 20, 20, 20]
+
+
+def create_small_files_workload(directory, count=200, size=(256, 256)):
+    for index in range(count):
+        image = Image.effect_noise(size, 64).convert('RGB')
+        image.save(os.path.join(directory, f"small_{index:04d}.png"))
+
+
+def create_stacks_workload(directory, count=8, frames=64, size=(512, 512)):
+    for index in range(count):
+        images = [Image.effect_noise(size, 32 + frame) for frame in range(frames)]
+        images[0].save(os.path.join(directory, f"stack_{index:02d}.tif"), save_all=True, append_images=images[1:])
+
+
+def create_channels_workload(directory, groups=8, channels=12, size=(1024, 1024)):
+    for group in range(groups):
+        for channel in range(channels):
+            image = Image.effect_noise(size, 16 + channel)
+            image.save(os.path.join(directory, f"sample{group:02d}_ch{channel:02d}.tif"))
+
+
+def run_engine(engine, source_directory, merge):
+    with tempfile.TemporaryDirectory() as destination_directory:
+        copy_source_directory_tree(source_directory, destination_directory)
+        start = time.perf_counter()
+        manager, queue = create_progress_queue(engine)
+        if merge:
+            files = collect_multi_frame_tiff_groups(source_directory).values()
+            function_exec = merge_tiffs
+        else:
+            files = [os.path.join(root, file) for root, _, names in os.walk(source_directory) for file in names]
+            function_exec = process_file
+        tasks = create_compression_tasks(files, source_directory, destination_directory, COMPRESSION_OPTION, queue,
+                                         WIDTHS, merge=merge)
+        with create_pool(engine) as pool:
+            results = [pool.apply_async(function_exec, args=task) for task in tasks]
+            for result in results:
+                result.get()
+        return time.perf_counter() - start
+
+
+def main():
+    workloads = [
+        ("Many small files", create_small_files_workload, False),
+        ("Multi-frame stacks", create_stacks_workload, False),
+        ("Channel merge", create_channels_workload, True),
+    ]
+    print(f"Pool size: {POOL_SIZE} - Compression option: {COMPRESSION_OPTION}")
+    for name, create_workload, merge in workloads:
+        with tempfile.TemporaryDirectory() as source_directory:
+            create_workload(source_directory)
+            timings = {engine: run_engine(engine, source_directory, merge) for engine in ('Processes', 'Threads')}
+            if merge:
+                auto_engine = choose_execution_engine(collect_multi_frame_tiff_groups(source_directory).values(), True)
+            else:
+                auto_engine = choose_execution_engine(
+                    [os.path.join(source_directory, file) for file in os.listdir(source_directory)])
+            winner = min(timings, key=timings.get)
+            print(f"{name}: Processes {timings['Processes']:.2f}s | Threads {timings['Threads']:.2f}s | "
+                  f"Best: {winner} | Auto picks: {auto_engine}")
+
+
+if __name__ == "__main__":
+    freeze_support()
+    main()
@@ -0,0 +1,90 @@
+import numpy as np
+from PIL import Image, TiffImagePlugin, TiffTags
+
+BIT_DEPTH_REDUCTION_OPTION = 'Compress with Lossless Bit Depth Reduction'
+# Narrower modes tried for each high bit depth mode, narrowest first
+NARROWER_MODES = {
+    'I;16': ['L'],
+    'I;16B': ['L'],
+    'I;16L': ['L'],
+    'I': ['L', 'I;16'],
+    'F': ['L', 'I;16'],
+}
+# Inclusive value range and NumPy type of the narrow modes
+MODE_RANGES = {'L': (0, 255), 'I;16': (0, 65535)}
+MODE_DTYPES = {'L': np.uint8, 'I;16': np.uint16}
+# Private TIFF tag (ASCII) recording the type the samples had in the source file
+ORIGINAL_TYPE_TAG = 65000
+# Tags describing the source samples, Pillow only rewrites BitsPerSample itself
+SAMPLE_TAGS = {258, 339, 340, 341}
+# TIFF SampleFormat -> kind of the stored samples
+SAMPLE_FORMAT_KINDS = {1: 'uint', 2: 'int', 3: 'float'}
+# Raw modes the PNG decoder reads samples with, Pillow opens 16-bit grayscale PNGs as mode I
+PNG_RAWMODE_TYPES = {'L': 'uint8', 'I;16B': 'uint16'}
+
+
+def is_bit_depth_reduction(compression_option):
+    return compression_option == BIT_DEPTH_REDUCTION_OPTION
+
+
+def find_narrower_mode(frames):
+    """Narrowest mode holding every sample of every frame exactly, or None. Frames are checked one at a time."""
+    candidates = None
+    for frame in frames:
+        if candidates is None:
+            mode = frame.mode
+            candidates = list(NARROWER_MODES.get(mode, []))
+        if frame.mode != mode or not candidates:
+            return None
+        samples = np.asarray(frame)
+        if samples.dtype.kind == 'f':
+            # Only whole numbers survive an integer type, NaN and infinities never do
+            if not np.isfinite(samples).all() or not np.array_equal(samples, np.floor(samples)):
+                return None
+        low = samples.min()
+        high = samples.max()
+        candidates = [candidate for candidate in candidates
+                      if MODE_RANGES[candidate][0] <= low and high <= MODE_RANGES[candidate][1]]
+    return candidates[0] if candidates else None
+
+
+def get_stored_sample_type(img):
+    """Type of the samples in the file ('uint16', 'float32', ...), img must be opened and not loaded yet."""
+    tags = getattr(img, 'tag_v2', None)
+    if tags is not None and 258 in tags:
+        bits = tags[258][0] if isinstance(tags[258], tuple) else tags[258]
+        sample_format = tags.get(339, 1)
+        sample_format = sample_format[0] if isinstance(sample_format, tuple) else sample_format
+        return f"{SAMPLE_FORMAT_KINDS.get(sample_format, 'uint')}{bits}"
+    if img.format == 'PNG' and img.tile and img.tile[0][3] in PNG_RAWMODE_TYPES:
+        return PNG_RAWMODE_TYPES[img.tile[0][3]]
+    # Other formats store the samples the way Pillow holds them
+    return np.asarray(img.crop((0, 0, 1, 1))).dtype.name
+
+
+def narrow_frame(frame, mode, original_type):
+    narrowed = Image.fromarray(np.asarray(frame).astype(MODE_DTYPES[mode]), mode)
+    source_metadata = getattr(frame, 'tag_v2', None) or frame.info.get('tag_v2')
+    metadata = TiffImagePlugin.ImageFileDirectory_v2()
+    if source_metadata:
+        for tag, value in source_metadata.items():
+            if tag not in SAMPLE_TAGS and tag in source_metadata.tagtype:
+                metadata[tag] = value
+                metadata.tagtype[tag] = source_metadata.tagtype[tag]
+    metadata[ORIGINAL_TYPE_TAG] = f"SmartImageShrink original type: {original_type}"
+    metadata.tagtype[ORIGINAL_TYPE_TAG] = TiffTags.ASCII
+    # save_image_and_compress writes tag_v2 into TIFFs and original_type into PNG text chunks
+    narrowed.info['tag_v2'] = metadata
+    narrowed.info['original_type'] = original_type
+    return narrowed
+
+
+def narrow_bit_depth(frames, stored_type):
+    # Frames (same mode) -> narrowed copies when that is exactly lossless, else the frames unchanged.
+    # stored_type comes from get_stored_sample_type on the source file.
+    narrower_mode = find_narrower_mode(frames)
+    if narrower_mode is None:
+        return frames
+    if np.dtype(MODE_DTYPES[narrower_mode]).name == stored_type:
+        return frames  # Narrower than Pillow's mode only, the file already stores these samples
+    return [narrow_frame(frame, narrower_mode, stored_type) for frame in frames]
@@ -1,20 +1,59 @@
+import itertools
 import os
 import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
 import wx.adv
 import multiprocessing
 from multiprocessing import Manager
-from PIL import Image, TiffImagePlugin
+from multiprocessing.pool import ThreadPool
+from queue import Queue, Empty
+from PIL import Image, TiffImagePlugin, JpegImagePlugin, PngImagePlugin
 
 from helpers import format_table_row, bytes_to_mb, create_log_file, is_supported_file, is_multi_frame, \
     log_to_console, collect_multi_frame_tiff_groups, merge_tiffs, get_channel_range, extract_frames_with_metadata, \
-    resize_image
-
-num_tasks_completed = 0
-
-
-def run_compression(compression_choice, source_directory, destination_directory, console_output, is_stop_requested,
-                    should_merge):
-    compression_option = compression_choice.GetString(compression_choice.GetSelection())
+    resize_image, is_multi_resolution, get_pyramid_factors, build_resolution_pyramid, merge_tiffs_multi_resolution, \
+    get_resized_dimensions, get_resampling_method, save_lzw_tiff
+from target_search import is_target_mode, find_target_factors, parse_target
+from bit_depth import is_bit_depth_reduction, narrow_bit_depth, get_stored_sample_type
+from verification import is_lossless_option, is_verification_failure, verify_lossless, get_verification_indicator
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Worker count shared by both execution engines
+POOL_SIZE = 4
+# 'Auto' picks threads when the average file is smaller than this (bytes), pool start-up and pickling dominate there
+SMALL_FILE_THRESHOLD = 8 * 1000 * 1000
+EXECUTION_ENGINES = ['Auto', 'Processes', 'Threads']
+
+# Long-lived pools kept for the whole GUI session, one (pool, queue, manager, started) per execution engine
+worker_pools = {}
+worker_pools_lock = threading.Lock()
+
+# Worker processes are replaced after this many tasks, or before their next task once their peak RSS passed the limit
+MAX_TASKS_PER_WORKER = 100
+WORKER_RSS_LIMIT = 4 * 1000 * 1000 * 1000
+# A task running longer than this (seconds) gets its worker killed and is retried
+TASK_TIMEOUT_SECONDS = 60 * 60
+# A worker found dead is only declared crashed after this long (seconds), its last result may still be in flight
+DEAD_WORKER_GRACE_SECONDS = 2
+
+# Failed task record, logged instead of a (saved, initial, final, name) result
+TaskFailure = namedtuple('TaskFailure', ['name', 'error'])
+# Sources that failed twice in the current run are not handed to a worker again, every run starts afresh
+quarantined_sources = set()
+task_ids = itertools.count()
+
+
+def run_compression(compression_option, source_directory, destination_directory, console_output, is_stop_requested,
+                    should_merge, execution_engine='Auto', verify_lossless_outputs=False):
     apply_results_merge = []
     # For logging
     widths = [95, 20, 20, 20]  # Column widths
@@ -22,23 +61,28 @@ def run_compression(compression_choice, source_directory, destination_directory,
 
     MSG_START_COMPRESSION = f"[▶] Compression with: {compression_option}!\n"
     log_to_console(console_output, MSG_START_COMPRESSION, None, True)
-    copy_source_directory_tree(source_directory, destination_directory)
+    quarantined_sources.clear()
+    # Multi-resolution levels each get their own destination tree: destination/x2, destination/x4, ...
+    for output_root in get_output_roots(destination_directory, compression_option):
+        copy_source_directory_tree(source_directory, output_root)
     # Processing images
     if should_merge:
         log_to_console(console_output, '[*] Creating and compressing multi-frame images from your channels', None, True)
         apply_results_merge = compress_and_merge_tiff(console_output, source_directory, destination_directory,
-                                                      is_stop_requested, compression_option, widths)
+                                                      is_stop_requested, compression_option, widths, execution_engine,
+                                                      verify_lossless_outputs)
         if is_stop_requested():
             return "STOPPED"
 
         log_to_console(console_output, '[*] Multi-frame images from your channels created', None, True)
     log_to_console(console_output, '[*] Compressing images at directory', None, True)
     apply_results, skipped_files = process_directory(source_directory, destination_directory, compression_option,
-                                                     console_output, is_stop_requested, widths)
+                                                     console_output, is_stop_requested, widths, execution_engine,
+                                                     verify_lossless_outputs)
     if is_stop_requested():
         return "STOPPED"
     merged_results = apply_results_merge + apply_results
-    log_entries, num_files_processed, total_saved_size = process_results_create_log_entries(merged_results, skipped_files, widths)
+    log_entries, num_files_processed, total_saved_size = create_log_entries(merged_results, skipped_files, widths)
 
     if skipped_files:
         skipped_msg = f"[⚠] {len(skipped_files)} files were not processed (unsupported extensions) - {', '.join(skipped_files)}"
@@ -51,6 +95,16 @@ def run_compression(compression_choice, source_directory, destination_directory,
     return log_file_path if log_file_path else "STOPPED"
 
 
+def get_level_directory(destination_directory, factor):
+    return os.path.join(destination_directory, f"x{factor}")
+
+
+def get_output_roots(destination_directory, compression_option):
+    if is_multi_resolution(compression_option):
+        return [get_level_directory(destination_directory, factor) for factor in get_pyramid_factors(compression_option)]
+    return [destination_directory]
+
+
 def copy_source_directory_tree(src_dir, dest_dir):
     for root, dirs, files in os.walk(src_dir):
         for directory in dirs:
@@ -60,24 +114,45 @@ def copy_source_directory_tree(src_dir, dest_dir):
             os.makedirs(dest_dir_path, exist_ok=True)
 
 
-def process_results_create_log_entries(apply_results, skipped_files, widths):
+def create_log_entries(results, skipped_files, widths):
     num_files_processed = 0
     total_saved_size = 0
     log_entries = []
-    for result_obj in apply_results:
-        result = result_obj.get()
-        if result:
-            saved_size, initial_size, final_size, new_name = result
+    failed_entries = []
+    verification_failures = []
+    for result in results:
+        if isinstance(result, TaskFailure):
+            failed_entries.append(f"[✖] {result.name} - {result.error}")
+            continue
+        # Multi-resolution tasks return one result per level
+        for level_result in (result if isinstance(result, list) else [result]):
+            if not level_result:
+                continue
+            saved_size, initial_size, final_size, new_name = level_result[:4]
             total_saved_size += saved_size
             num_files_processed += 1
             is_merged = "_ch" in new_name and "to" in new_name
             merge_indicator = "[Merged]" if is_merged else ""
+            # Results of verified tasks carry the outcome of the lossless check as a fifth item
+            verification = level_result[4] if len(level_result) > 4 else None
+            if is_verification_failure(verification):
+                verification_failures.append(f"[✖] {new_name} - {verification}")
             log_entry = format_table_row(
-                ['[+] ' + merge_indicator + new_name, f"{bytes_to_mb(initial_size):.2f}",
+                ['[+] ' + get_verification_indicator(verification) + merge_indicator + new_name, f"{bytes_to_mb(initial_size):.2f}",
                  f"{bytes_to_mb(final_size):.2f}",
                  f"{bytes_to_mb(saved_size):.2f}"], widths)
             log_entries.append(log_entry)
 
+    if verification_failures:
+        log_entries.append("========================================\n")
+        log_entries.append(f"[✖] {len(verification_failures)} files did not pass the lossless verification:")
+        log_entries.extend(verification_failures)
+
+    if failed_entries:
+        log_entries.append("========================================\n")
+        log_entries.append(f"[✖] {len(failed_entries)} files failed twice and were quarantined:")
+        log_entries.extend(failed_entries)
+
     if skipped_files:
         log_entries.append("========================================\n")
         skipped_msg = f"[⚠] {len(skipped_files)} files were not processed - {', '.join(skipped_files)}"
@@ -87,72 +162,316 @@ def process_results_create_log_entries(apply_results, skipped_files, widths):
 
 
 def compress_and_merge_tiff(console_output, source_directory, destination_directory, is_stop_requested_gui,
-                            compression_option, widths):
-    # For multiprocessing
-    global num_tasks_completed
-    num_tasks_completed = 0
+                            compression_option, widths, execution_engine='Auto', verify=False):
+    apply_results_merge = []
 
     # Processing images
     grouped_files = collect_multi_frame_tiff_groups(source_directory)
 
-    manager = Manager()
-    queue = manager.Queue()
-    tasks = create_compression_tasks(grouped_files.values(), source_directory, destination_directory, compression_option, queue, widths, merge=True)
+    engine = resolve_execution_engine(execution_engine, grouped_files.values(), merge=True)
+    queue = get_worker_pool(engine)[1]
+    tasks = create_compression_tasks(grouped_files.values(), source_directory, destination_directory, compression_option,
+                                     queue, widths, merge=True, verify=verify)
 
+    function_exec = get_function_exec(compression_option, merge=True)
     if tasks:
-        apply_results_merge = parallel_processing(console_output, tasks, queue, is_stop_requested_gui, merge_tiffs)
+        apply_results_merge = parallel_processing(console_output, tasks, queue, is_stop_requested_gui, function_exec,
+                                                  engine)
 
     return apply_results_merge
 
 
 def process_directory(src_dir, dest_dir, compression_option, console_output, is_stop_requested_gui,
-                      widths):
+                      widths, execution_engine='Auto', verify=False):
     skipped_files = []
     supported_files = []
-    # For multiprocessing
-    global num_tasks_completed
-    num_tasks_completed = 0
 
     supported_files = [os.path.join(root, file) for root, _, files in os.walk(src_dir) for file in files if is_supported_file(file)]
     skipped_files = [file for root, _, files in os.walk(src_dir) for file in files if not is_supported_file(os.path.join(root, file))]
 
-    manager = Manager()
-    queue = manager.Queue()
-    tasks = create_compression_tasks(supported_files, src_dir, dest_dir, compression_option, queue, widths, merge=False)
-    apply_results = parallel_processing(console_output, tasks, queue, is_stop_requested_gui, process_file)
+    # Huge TIFFs would keep one worker busy long after the others ran out of files, they are split across the pool
+    from tiled_tiff import is_split_candidate, process_split_file
+    split_files = [file for file in supported_files if is_split_candidate(file, compression_option)]
+    supported_files = [file for file in supported_files if file not in split_files]
+
+    engine = resolve_execution_engine(execution_engine, supported_files, merge=False)
+    queue = get_worker_pool(engine)[1]
+    tasks = create_compression_tasks(supported_files, src_dir, dest_dir, compression_option, queue, widths, merge=False,
+                                     verify=verify)
+    function_exec = get_function_exec(compression_option, merge=False)
+    apply_results = parallel_processing(console_output, tasks, queue, is_stop_requested_gui, function_exec, engine)
+
+    for task in create_compression_tasks(split_files, src_dir, dest_dir, compression_option, queue, widths, merge=False,
+                                         verify=verify):
+        src_path, dest_path = task[:2]
+        if is_stop_requested_gui():
+            break
+        result = process_split_file(src_path, get_new_file_path_new_name(dest_path, compression_option),
+                                    compression_option, widths, console_output, is_stop_requested_gui,
+                                    execution_engine, verify=task[-1])
+        if result == "STOPPED":
+            break
+        if isinstance(result, TaskFailure):
+            log_to_console(console_output, f"[✖] {result.name} - {result.error}", wx.RED, True)
+        apply_results.append(result)
 
     return apply_results, skipped_files
 
 
-def parallel_processing(console_output, tasks, queue, is_stop_requested_gui, function_exec):
-    # For multiprocessing
-    global num_tasks_completed
-    num_tasks_completed = 0
-    apply_results = []  # List to store ApplyResult objects
+def get_function_exec(compression_option, merge=False):
+    if merge:
+        return merge_tiffs_multi_resolution if is_multi_resolution(compression_option) else merge_tiffs
+    return process_file_multi_resolution if is_multi_resolution(compression_option) else process_file
+
+
+def resolve_execution_engine(execution_engine, files, merge=False):
+    if execution_engine in ('Processes', 'Threads'):
+        return execution_engine
+    return choose_execution_engine(files, merge)
+
+
+def choose_execution_engine(files, merge=False):
+    # Pillow releases the GIL while decoding, resizing and encoding, so threads win whenever the per-image
+    # work is short and the process pool start-up + pickling would dominate. The per-frame Python loops
+    # (merging channels, multi-frame stacks) hold the GIL and scale better on processes.
+    files = list(files)
+    if not files:
+        return 'Threads'
+    if merge:
+        return 'Processes'
+    average_size = sum(os.path.getsize(file) for file in files) / len(files)
+    if average_size < SMALL_FILE_THRESHOLD:
+        return 'Threads'
+    tiff_count = sum(1 for file in files if file.lower().endswith(('.tif', '.tiff')))
+    return 'Processes' if tiff_count * 2 >= len(files) else 'Threads'
+
+
+def create_progress_queue(execution_engine):
+    # Threads share memory, a Manager queue is only needed to talk across processes
+    if execution_engine == 'Threads':
+        return None, Queue()
+    manager = Manager()
+    return manager, manager.Queue()
+
+
+def create_pool(execution_engine, maxtasksperchild=MAX_TASKS_PER_WORKER, processes=POOL_SIZE):
+    if execution_engine == 'Threads':
+        return ThreadPool(processes=processes)
+    return multiprocessing.Pool(processes=processes, maxtasksperchild=maxtasksperchild)
+
+
+def get_worker_pool(execution_engine):
+    # Spawned workers re-import wx and PIL, so the pool is created once and shared by every run of the session
+    with worker_pools_lock:
+        if execution_engine not in worker_pools:
+            pool = create_pool(execution_engine)
+            # Manager must stay referenced while the pool runs, otherwise its queue server shuts down
+            manager, queue = create_progress_queue(execution_engine)
+            # task id -> (worker pid, start time, recycled), written by the workers for the TaskSupervisor
+            started = manager.dict() if manager else {}
+            worker_pools[execution_engine] = (pool, queue, manager, started)
+        return worker_pools[execution_engine]
+
+
+def warm_up_worker(_):
+    return os.getpid()
+
+
+def warm_up_worker_pools(execution_engine='Processes'):
+    # Run a no-op on every worker so the start-up cost is paid before the first Start Compression click
+    pool = get_worker_pool(execution_engine)[0]
+    pool.map(warm_up_worker, range(POOL_SIZE))
+
 
-    def task_completed(result):
-        global num_tasks_completed
-        num_tasks_completed += 1
-        if num_tasks_completed == len(tasks):
-            queue.put("DONE")
+def discard_worker_pool(execution_engine):
+    # Kills running tasks (used on stop), the next run creates a fresh pool
+    with worker_pools_lock:
+        pool_entry = worker_pools.pop(execution_engine, None)
+    if pool_entry:
+        pool, _, manager, _ = pool_entry
+        pool.terminate()
+        pool.join()
+        if manager:
+            manager.shutdown()
 
-    # Process files in parallel using multiprocessing.Pool
-    with multiprocessing.Pool(processes=4) as pool:
-        for task in tasks:
+
+def shutdown_worker_pools():
+    # End of the session: nothing left to wait for
+    for execution_engine in list(worker_pools):
+        discard_worker_pool(execution_engine)
+
+
+def drain_queue(queue):
+    # Leftover messages from a stopped run must not leak into the next one
+    while True:
+        try:
+            queue.get_nowait()
+        except Empty:
+            break
+
+
+def get_peak_rss():
+    # Peak resident memory of this process in bytes, 0 where the resource module is missing
+    if resource is None:
+        return 0
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def run_supervised_task(function_exec, task, task_id, started):
+    # Runs in the worker. A worker process that grew past WORKER_RSS_LIMIT exits instead of taking the task,
+    # the supervisor hands the task to another worker and the pool starts a fresh one.
+    in_worker_process = multiprocessing.parent_process() is not None
+    if in_worker_process and get_peak_rss() > WORKER_RSS_LIMIT:
+        started[task_id] = (os.getpid(), time.time(), True)
+        os._exit(0)
+    started[task_id] = (os.getpid(), time.time(), False)
+    return function_exec(*task)
+
+
+def get_task_name(task):
+    # First task argument is the source file, or the list of channel files of a merge group
+    source = task[0]
+    return source if isinstance(source, str) else f"{source[0]} (+{len(source) - 1} channels)"
+
+
+class TaskSupervisor:
+    """Runs tasks on the session pool with per-task timeouts, one retry in a fresh worker and quarantine."""
+
+    def __init__(self, execution_engine, on_task_done=None):
+        self.execution_engine = execution_engine
+        # Called with (task, result or TaskFailure) once a task is finished for good
+        self.on_task_done = on_task_done
+        self.pool, _, _, self.started = get_worker_pool(execution_engine)
+        self.retry_pool = None
+        self.in_flight = []
+        self.results = []
+        self.unreported_failures = []
+
+    def submit(self, function_exec, task, attempt=0):
+        name = get_task_name(task)
+        if name in quarantined_sources:
+            self.record_failure(TaskFailure(name, "quarantined earlier in this run"), task)
+            return
+        task_id = next(task_ids)
+        pool = self.pool if attempt == 0 else self.get_retry_pool()
+        result = pool.apply_async(run_supervised_task, args=(function_exec, task, task_id, self.started))
+        self.in_flight.append({'task_id': task_id, 'function_exec': function_exec, 'task': task, 'name': name,
+                               'attempt': attempt, 'result': result, 'dead_since': None})
+
+    def get_retry_pool(self):
+        # Every retried task gets a brand new worker process, retries are rare so one runs at a time
+        if self.retry_pool is None:
+            self.retry_pool = create_pool(self.execution_engine, maxtasksperchild=1, processes=1)
+        return self.retry_pool
+
+    def handle_failure(self, entry, error):
+        if entry['attempt'] == 0:
+            self.submit(entry['function_exec'], entry['task'], attempt=1)
+            return
+        quarantined_sources.add(entry['name'])
+        self.record_failure(TaskFailure(entry['name'], error), entry['task'])
+
+    def record_failure(self, failure, task):
+        self.results.append(failure)
+        self.unreported_failures.append(failure)
+        if self.on_task_done:
+            self.on_task_done(task, failure)
+
+    def pop_unreported_failures(self):
+        failures, self.unreported_failures = self.unreported_failures, []
+        return failures
+
+    def poll(self):
+        now = time.time()
+        started = self.started.copy()  # One round trip to the Manager instead of one per task
+        live_pids = None
+        if self.execution_engine != 'Threads':
+            live_pids = {child.pid for child in multiprocessing.active_children()}
+        for entry in list(self.in_flight):
+            if entry['result'].ready():
+                self.in_flight.remove(entry)
+                self.started.pop(entry['task_id'], None)
+                try:
+                    result = entry['result'].get()
+                except Exception as e:
+                    self.handle_failure(entry, f"{type(e).__name__}: {e}")
+                    continue
+                self.results.append(result)
+                if self.on_task_done:
+                    self.on_task_done(entry['task'], result)
+                continue
+            if entry['task_id'] not in started:
+                continue  # Still queued
+            pid, start_time, recycled = started[entry['task_id']]
+            if live_pids is not None and pid not in live_pids:
+                entry['dead_since'] = entry['dead_since'] or now
+                if now - entry['dead_since'] < DEAD_WORKER_GRACE_SECONDS:
+                    continue
+                self.in_flight.remove(entry)
+                self.started.pop(entry['task_id'], None)
+                if recycled:
+                    self.submit(entry['function_exec'], entry['task'], entry['attempt'])
+                else:
+                    self.handle_failure(entry, "worker process crashed (segfault or out of memory)")
+            elif now - start_time > TASK_TIMEOUT_SECONDS:
+                self.in_flight.remove(entry)
+                self.started.pop(entry['task_id'], None)
+                # Threads cannot be killed, the task is given up on either way
+                if live_pids is not None:
+                    try:
+                        os.kill(pid, signal.SIGTERM)
+                    except OSError:
+                        pass
+                self.handle_failure(entry, f"timed out after {TASK_TIMEOUT_SECONDS} seconds")
+
+    def close(self):
+        if self.retry_pool is not None:
+            self.retry_pool.terminate()
+            self.retry_pool.join()
+            self.retry_pool = None
+
+
+def parallel_processing(console_output, tasks, queue, is_stop_requested_gui, function_exec, execution_engine='Processes'):
+    if not tasks:
+        return []
+
+    # Process files in parallel on the session pool, both engines share the apply_async interface
+    supervisor = TaskSupervisor(execution_engine)
+    drain_queue(queue)
+    for task in tasks:
+        if is_stop_requested_gui():
+            break
+        supervisor.submit(function_exec, task)
+    # Continuously read from the queue and update the UI until every task finished or failed for good
+    try:
+        while supervisor.in_flight:
             if is_stop_requested_gui():
+                discard_worker_pool(execution_engine)
                 break
-            result = pool.apply_async(function_exec, args=task, callback=task_completed)
-            apply_results.append(result)
-        # Continuously read from the queue and update the UI
-        while True:
-            message = queue.get()
-            if message == "DONE" or is_stop_requested_gui():
-                break
-            log_to_console(console_output, message, wx.GREEN, True)
-    return apply_results
+            try:
+                message = queue.get(timeout=0.5)
+                log_to_console(console_output, message, wx.GREEN, True)
+            except Empty:
+                pass
+            supervisor.poll()
+            for failure in supervisor.pop_unreported_failures():
+                log_to_console(console_output, f"[✖] {failure.name} - {failure.error}", wx.RED, True)
+    finally:
+        supervisor.close()
+    # Progress lines of the last tasks
+    while True:
+        try:
+            log_to_console(console_output, queue.get_nowait(), wx.GREEN, True)
+        except Empty:
+            break
+    return supervisor.results
 
 
-def create_compression_tasks(files, source_directory, destination_directory, compression_option, queue, widths, merge=False):
+def create_compression_tasks(files, source_directory, destination_directory, compression_option, queue, widths, merge=False,
+                             verify=False):
+    # Only options that keep every pixel are verified, a resized output cannot match its source
+    verify = verify and is_lossless_option(compression_option)
     tasks = []
     for file_or_group in files:
         if merge:
@@ -165,35 +484,92 @@ def create_compression_tasks(files, source_directory, destination_directory, com
                 output_filename = f"{os.path.basename(file_or_group[0]).split('_ch')[0]}_ch{min_channel:02d}to{max_channel:02d}_compressed.tif"
             else:
                 output_filename = f"{os.path.basename(file_or_group[0]).split('_ch')[0]}_compressed.tif"
+            if is_multi_resolution(compression_option):
+                level_output_paths = [(factor, os.path.join(get_level_directory(destination_directory, factor),
+                                                            rel_dir_path, output_filename))
+                                      for factor in get_pyramid_factors(compression_option)]
+                tasks.append((file_or_group, level_output_paths, widths, queue, compression_option))
+                continue
             output_path = os.path.join(output_dir, output_filename)
-            tasks.append((file_or_group, output_path, widths, queue, compression_option))
+            tasks.append((file_or_group, output_path, widths, queue, compression_option, verify))
         else:
             # For individual file processing, 'file_or_group' is a single file path
             src_path = os.path.join(source_directory, file_or_group)
             rel_path = os.path.relpath(src_path, source_directory)
+            if is_multi_resolution(compression_option):
+                level_dest_paths = [(factor, os.path.join(get_level_directory(destination_directory, factor), rel_path))
+                                    for factor in get_pyramid_factors(compression_option)]
+                tasks.append((src_path, level_dest_paths, compression_option, queue, widths))
+                continue
             dest_path = os.path.join(destination_directory, rel_path)
-            tasks.append((src_path, dest_path, compression_option, queue, widths))
+            tasks.append((src_path, dest_path, compression_option, queue, widths, verify))
 
     return tasks
 
 
-def process_file(src_path, dest_path, compression_option, queue, widths):
+def get_task_output_paths(task, compression_option, merge=False):
+    # Files a task from create_compression_tasks writes, one per resolution level
+    if merge:
+        return [output_path for _, output_path in task[1]] if isinstance(task[1], list) else [task[1]]
+    if isinstance(task[1], list):
+        return [get_new_file_path_new_name(dest_path, f"Compress Size x{factor}") for factor, dest_path in task[1]]
+    return [get_new_file_path_new_name(task[1], compression_option)]
+
+
+def process_file(src_path, dest_path, compression_option, queue, widths, verify=False):
     dest_path_new_name = get_new_file_path_new_name(dest_path, compression_option)
 
-    compress_image(src_path, dest_path_new_name, compression_option)
+    verification = compress_image(src_path, dest_path_new_name, compression_option, verify)
 
     initial_size = os.path.getsize(src_path)
     final_size = os.path.getsize(dest_path_new_name)
     new_name = os.path.basename(dest_path_new_name)
     saved_size = initial_size - final_size if initial_size > final_size else 0
     console_entry = format_table_row(
-        ['[+] ' + new_name, f"Original Size: {bytes_to_mb(initial_size):.2f}MB",
+        ['[+] ' + get_verification_indicator(verification) + new_name,
+         f"Original Size: {bytes_to_mb(initial_size):.2f}MB",
          f"Final Size: {bytes_to_mb(final_size):.2f}MB",
          f"Saved: {bytes_to_mb(saved_size):.2f}MB"], widths)
     queue.put(console_entry)
+    if verification:
+        return saved_size, initial_size, final_size, new_name, verification
     return saved_size, initial_size, final_size, new_name
 
 
+def process_file_multi_resolution(src_path, level_dest_paths, compression_option, queue, widths):
+    # level_dest_paths: [(factor, dest_path)], the source is decoded once and every level is downsampled from the previous
+    factors = [factor for factor, _ in level_dest_paths]
+    level_paths = [(factor, get_new_file_path_new_name(dest_path, f"Compress Size x{factor}"))
+                   for factor, dest_path in level_dest_paths]
+    try:
+        with Image.open(src_path) as img:
+            if is_multi_frame(img):
+                levels = [[] for _ in factors]
+                for frame in extract_frames_with_metadata(img):
+                    for level_frames, level in zip(levels, build_resolution_pyramid(frame, factors)):
+                        level_frames.append(level)
+            else:
+                levels = build_resolution_pyramid(img, factors)
+            for level, (_, dest_path_new_name) in zip(levels, level_paths):
+                save_image_and_compress(level, dest_path_new_name, source_img=img)
+    except Exception as e:
+        raise RuntimeError(f"Error processing {src_path}: {e}") from e
+
+    results = []
+    initial_size = os.path.getsize(src_path)
+    for factor, dest_path_new_name in level_paths:
+        final_size = os.path.getsize(dest_path_new_name)
+        new_name = os.path.join(f"x{factor}", os.path.basename(dest_path_new_name))
+        saved_size = initial_size - final_size if initial_size > final_size else 0
+        console_entry = format_table_row(
+            ['[+] ' + new_name, f"Original Size: {bytes_to_mb(initial_size):.2f}MB",
+             f"Final Size: {bytes_to_mb(final_size):.2f}MB",
+             f"Saved: {bytes_to_mb(saved_size):.2f}MB"], widths)
+        queue.put(console_entry)
+        results.append((saved_size, initial_size, final_size, new_name))
+    return results
+
+
 def get_new_file_path_new_name(img_path, compression_option):
     base, ext = os.path.splitext(img_path)
     if compression_option == 'Compress with No Data Loss':
@@ -201,31 +577,84 @@ def get_new_file_path_new_name(img_path, compression_option):
     elif 'Compress Size' in compression_option:
         factor = compression_option.split(' ')[-1]  # Gets factor from COMPRESSION_OPTIONS text
         new_name = base + '_compressed_' + factor + ext
+    elif is_target_mode(compression_option):
+        new_name = base + '_compressed_target' + ext
     # In case any problems with compression_option
     else:
         new_name = base + '_compressed' + ext
     return new_name
 
 
-def compress_image(src_path, dest_path_new_name, compression_option):
+def compress_image(src_path, dest_path_new_name, compression_option, verify=False):
+    # Returns the outcome of the lossless verification, None when it was not requested
+    verification = None
     shutil.copy2(src_path, dest_path_new_name)
     try:
-        with Image.open(dest_path_new_name) as img:
+        # Decoded from the source, an uncompressed TIFF may be memory mapped and the copy is overwritten below
+        with Image.open(src_path) as img:
             if 'Compress Size' in compression_option:
                 if is_multi_frame(img):
                     resized_frames = resize_multi_frame_image(img, compression_option)
                     save_image_and_compress(resized_frames, dest_path_new_name)
                 else:
-                    img = resize_image(img, compression_option)
-                    save_image_and_compress(img, dest_path_new_name)
+                    resized_img = resize_image(img, compression_option)
+                    save_image_and_compress(resized_img, dest_path_new_name, source_img=img)
+            elif is_target_mode(compression_option):
+                compress_image_to_target(img, dest_path_new_name, compression_option)
             else:
-                if is_multi_frame(img):
-                    save_image_and_compress(extract_frames_with_metadata(img), dest_path_new_name)
+                # Read from the header, before the frames are decoded
+                stored_type = get_stored_sample_type(img) if is_bit_depth_reduction(compression_option) else None
+                source_frames = extract_frames_with_metadata(img) if is_multi_frame(img) else [img]
+                output_frames = source_frames
+                if stored_type:
+                    # Every frame is analysed before anything is written, the stack is stored narrower only as a whole
+                    output_frames = narrow_bit_depth(source_frames, stored_type)
+                if len(output_frames) > 1:
+                    save_image_and_compress(output_frames, dest_path_new_name)
                 else:
-                    save_image_and_compress(img, dest_path_new_name)
+                    save_image_and_compress(output_frames[0], dest_path_new_name, source_img=img)
+                if verify:
+                    # The decoded source frames are still in memory, only the output is decoded again
+                    verification = verify_lossless(source_frames, dest_path_new_name)
             del img
+        # Re-encoding a JPEG at its own quality can still come out larger, keep the original file then
+        if dest_path_new_name.lower().endswith(('.jpg', '.jpeg')) and 'Compress Size' not in compression_option \
+                and not is_target_mode(compression_option) and os.path.getsize(dest_path_new_name) >= os.path.getsize(src_path):
+            shutil.copy2(src_path, dest_path_new_name)
     except Exception as e:
-        print(f"Error processing {src_path}: {e}")
+        # Surfaces in the log as a failed (and retried) task instead of a silent copy of the source
+        raise RuntimeError(f"Error processing {src_path}: {e}") from e
+    return verification
+
+
+def compress_image_to_target(img, dest_path_new_name, compression_option):
+    # The search runs on proxies, only the chosen factor is encoded at full resolution
+    # (again with the next factor only if a byte budget was still exceeded)
+    multi_frame = is_multi_frame(img)
+    frames = extract_frames_with_metadata(img) if multi_frame else [img]
+    extension = os.path.splitext(dest_path_new_name)[1]
+
+    def encoded_size(candidate):
+        fd, candidate_path = tempfile.mkstemp(suffix=extension)
+        os.close(fd)
+        try:
+            save_image_and_compress(candidate, candidate_path, source_img=img)
+            return os.path.getsize(candidate_path)
+        finally:
+            os.remove(candidate_path)
+
+    def render(factor):
+        if factor == 1:
+            return frames if multi_frame else img
+        resized_frames = [frame.resize(get_resized_dimensions(frame.width, frame.height, factor),
+                                       get_resampling_method(frame)) for frame in frames]
+        return resized_frames if multi_frame else resized_frames[0]
+
+    target_kind, target_value = parse_target(compression_option)
+    for factor in find_target_factors(frames[0], compression_option, encoded_size, len(frames)):
+        save_image_and_compress(render(factor), dest_path_new_name, source_img=img)
+        if target_kind != 'Size' or os.path.getsize(dest_path_new_name) <= target_value:
+            break
 
 
 def resize_multi_frame_image(img, compression_option):
@@ -243,31 +672,53 @@ def resize_multi_frame_image(img, compression_option):
     return resized_frames
 
 
-def save_image_and_compress(img, img_path):
+def get_jpeg_save_options(img, source_img=None):
+    # Re-encode with the source's own quantization tables and subsampling instead of quality=95,
+    # a JPEG saved at a lower quality is neither inflated nor degraded by another generation
+    source_img = source_img if source_img is not None else img
+    options = {'optimize': True, 'progressive': True}
+    if getattr(source_img, 'format', None) != 'JPEG' or not getattr(source_img, 'quantization', None):
+        options['quality'] = 95
+    elif img is source_img:
+        options['quality'] = 'keep'
+    else:
+        # quality='keep' only works on the opened JPEG itself, resized copies get the tables explicitly
+        options['qtables'] = source_img.quantization
+        options['subsampling'] = JpegImagePlugin.get_sampling(source_img)
+    return options
+
+
+def save_image_and_compress(img, img_path, source_img=None):
     try:
         if img_path.lower().endswith('.png'):
-            img.save(img_path, optimize=True, compress_level=9)
+            pnginfo = None
+            if 'original_type' in img.info:
+                pnginfo = PngImagePlugin.PngInfo()
+                pnginfo.add_text('SmartImageShrink original type', img.info['original_type'])
+            img.save(img_path, optimize=True, compress_level=9, pnginfo=pnginfo)
         elif img_path.lower().endswith(('.jpg', '.jpeg')):
             # If for some reason jpg got Alpha Channel
             if img.mode == 'RGBA':
+                source_img = source_img if source_img is not None else img
                 img = img.convert('RGB')
-            img.save(img_path, optimize=True, quality=95, progressive=True)
+            img.save(img_path, **get_jpeg_save_options(img, source_img))
         elif img_path.lower().endswith('.webp'):
-            img.save(img_path, quality=95, lossless=True, method=6)
+            # exact keeps the color of fully transparent pixels, lossless mode would otherwise rewrite them
+            img.save(img_path, quality=95, lossless=True, method=6, exact=True)
         elif img_path.lower().endswith(('.bmp', '.dib')):
             img.save(img_path)
         elif img_path.lower().endswith(('.tif', '.tiff')):
             # Handle multi-frame TIFF
             if isinstance(img, list):
                 metadata = img[0].info.get("tag_v2", TiffImagePlugin.ImageFileDirectory_v2())
-                img[0].save(img_path, save_all=True, append_images=img[1:], compression='tiff_lzw', tiffinfo=metadata)
+                save_lzw_tiff(img, img_path, metadata)
             else:
                 metadata = img.info.get("tag_v2", TiffImagePlugin.ImageFileDirectory_v2())
-                img.save(img_path, compression='tiff_lzw', tiffinfo=metadata)
+                save_lzw_tiff([img], img_path, metadata)
         else:
-            print(f"Unsupported file format for {img_path}")
+            raise ValueError(f"Unsupported file format for {img_path}")
     except Exception as e:
-        print(f"Error saving {img_path}: {e}")
+        raise RuntimeError(f"Error saving {img_path}: {e}") from e
 
 
 def request_stop(stop_flag_callback, console_output):
@@ -0,0 +1,160 @@
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+from functools import partial
+import wx.adv
+
+from compress_logic import get_worker_pool, get_function_exec, create_compression_tasks, discard_worker_pool, \
+    drain_queue, TaskSupervisor, TaskFailure, POOL_SIZE
+from helpers import is_supported_file, collect_multi_frame_tiff_groups, log_to_console, format_table_row, bytes_to_mb
+
+# Files fully processed per (format, size bucket) stratum, and per size bucket of channel groups
+SAMPLES_PER_BUCKET = 3
+# Upper bounds (bytes) of the size buckets, anything larger falls in the last one
+SIZE_BUCKET_LIMITS = [1000 * 1000, 10 * 1000 * 1000, 100 * 1000 * 1000, 1000 * 1000 * 1000]
+
+
+def get_size_bucket(size):
+    for index, limit in enumerate(SIZE_BUCKET_LIMITS):
+        if size < limit:
+            return index
+    return len(SIZE_BUCKET_LIMITS)
+
+
+def get_format_bucket(file_path):
+    extension = os.path.splitext(file_path)[1].lower()
+    return {'.tiff': '.tif', '.jpeg': '.jpg', '.dib': '.bmp'}.get(extension, extension)
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(math.ceil(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m {seconds:02d}s"
+
+
+def run_timed_task(function_exec, *task):
+    # Runs in the worker, the time includes decode, processing and encode like a real run
+    start = time.perf_counter()
+    result = function_exec(*task)
+    return time.perf_counter() - start, result
+
+
+def collect_strata(source_directory, should_merge):
+    # stratum key -> [(item, size)], an item is a file path or a channel group (list of paths)
+    strata = {}
+    # Channel files of a group are still compressed on their own as well, so they stay in their format buckets
+    grouped_files = collect_multi_frame_tiff_groups(source_directory) if should_merge else {}
+    for files in grouped_files.values():
+        size = sum(os.path.getsize(file_path) for file_path in files)
+        strata.setdefault(('merge', get_size_bucket(size)), []).append((files, size))
+    for root, _, files in os.walk(source_directory):
+        for file in files:
+            file_path = os.path.join(root, file)
+            if not is_supported_file(file_path):
+                continue
+            size = os.path.getsize(file_path)
+            strata.setdefault((get_format_bucket(file_path), get_size_bucket(size)), []).append((file_path, size))
+    return strata
+
+
+def estimate_compression(compression_options, source_directory, console_output, is_stop_requested, should_merge):
+    """Process a stratified sample outside the destination and extrapolate size, savings and time per option."""
+    MSG_START_DRY_RUN = "[▶] Dry run: estimating savings and run time from a sample of the Source Directory\n"
+    log_to_console(console_output, MSG_START_DRY_RUN, None, True)
+    widths = [95, 20, 20, 20]
+    strata = collect_strata(source_directory, should_merge)
+    if not strata:
+        log_to_console(console_output, "[⚠] No supported files to estimate", wx.RED, True)
+        return "ESTIMATED"
+
+    sampler = random.Random(0)  # Same sample on every dry run of the same tree
+    samples = {key: sampler.sample(items, min(SAMPLES_PER_BUCKET, len(items))) for key, items in strata.items()}
+    # Source files counted once, the merge strata only add outputs on top of the per-file ones
+    total_files = sum(len(items) for key, items in strata.items() if key[0] != 'merge')
+    total_size = sum(size for key, items in strata.items() if key[0] != 'merge' for _, size in items)
+    sample_count = sum(len(items) for items in samples.values())
+    MSG_SAMPLE = (f"[*] {total_files} files ({bytes_to_mb(total_size):.2f} MB) in {len(strata)} format/size buckets, "
+                  f"processing {sample_count} samples for {len(compression_options)} options")
+    log_to_console(console_output, MSG_SAMPLE, None, True)
+
+    engine = 'Processes'
+    queue = get_worker_pool(engine)[1]
+    # Samples are written to a scratch directory only, never to the destination
+    scratch_directory = tempfile.mkdtemp(prefix="smartimageshrink_dry_run_")
+    estimates = []
+    try:
+        for option_index, compression_option in enumerate(compression_options):
+            option_directory = os.path.join(scratch_directory, str(option_index))
+            # key -> [sample input bytes, sample output bytes, sample seconds]
+            measured = {}
+            sample_of_task = {}
+
+            def on_sample_done(task, result):
+                key, size = sample_of_task.pop(id(task))
+                if isinstance(result, TaskFailure):
+                    return  # A sample that cannot be processed says nothing about the rest of its bucket
+                elapsed, task_result = result
+                levels = task_result if isinstance(task_result, list) else [task_result]
+                totals = measured.setdefault(key, [0, 0, 0.0])
+                totals[0] += size
+                totals[1] += sum(level[2] for level in levels if level)
+                totals[2] += elapsed
+
+            supervisor = TaskSupervisor(engine, on_sample_done)
+            for key, items in samples.items():
+                merge = key[0] == 'merge'
+                files = [item for item, _ in items]
+                tasks = create_compression_tasks(files, source_directory, option_directory, compression_option,
+                                                 queue, widths, merge=merge)
+                for task, (_, size) in zip(tasks, items):
+                    outputs = task[1] if isinstance(task[1], list) else [(None, task[1])]
+                    for _, output_path in outputs:
+                        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                    sample_of_task[id(task)] = (key, size)
+                    supervisor.submit(partial(run_timed_task, get_function_exec(compression_option, merge)), task)
+
+            try:
+                while supervisor.in_flight:
+                    if is_stop_requested():
+                        discard_worker_pool(engine)
+                        return "STOPPED"
+                    time.sleep(0.5)
+                    supervisor.poll()
+                    for failure in supervisor.pop_unreported_failures():
+                        log_to_console(console_output, f"[✖] Dry run sample failed: {failure.name} - {failure.error}",
+                                       wx.RED, True)
+            finally:
+                supervisor.close()
+            drain_queue(queue)
+            shutil.rmtree(option_directory, ignore_errors=True)
+
+            estimated_output = 0
+            estimated_seconds = 0.0
+            for key, items in strata.items():
+                sample_input, sample_output, sample_seconds = measured.get(key, (0, 0, 0.0))
+                if not sample_input:
+                    continue
+                bucket_size = sum(size for _, size in items)
+                estimated_output += bucket_size * sample_output / sample_input
+                estimated_seconds += bucket_size * sample_seconds / sample_input
+            estimated_saved = max(total_size - estimated_output, 0)
+            # Samples ran POOL_SIZE at a time, so their timings already include the contention of a real run
+            estimated_wall_time = estimated_seconds / min(POOL_SIZE, os.cpu_count() or 1)
+            estimates.append((compression_option, estimated_output, estimated_saved, estimated_wall_time))
+    finally:
+        shutil.rmtree(scratch_directory, ignore_errors=True)
+
+    header = ["Compression Option", "Est. Output (MB)", "Est. Saved (MB)", "Est. Time"]
+    log_to_console(console_output, "========================================", None, False)
+    log_to_console(console_output, format_table_row(header, widths), None, False)
+    for compression_option, estimated_output, estimated_saved, estimated_wall_time in estimates:
+        row = format_table_row([compression_option, f"{bytes_to_mb(estimated_output):.2f}",
+                                f"{bytes_to_mb(estimated_saved):.2f}", format_duration(estimated_wall_time)], widths)
+        log_to_console(console_output, row, wx.GREEN, False)
+    MSG_DRY_RUN_ENDED = "[*] Dry run ended - estimates only, nothing was written to the Destination Directory\n"
+    log_to_console(console_output, MSG_DRY_RUN_ENDED, None, True)
+    log_to_console(console_output, "========================================\n", None, False)
+    return "ESTIMATED"
@@ -2,21 +2,39 @@ import os
 import platform
 import subprocess
 import sys
+import threading
 import webbrowser
 import wx.adv
 import wx.lib.buttons as buttons
 from wx.lib.delayedresult import startWorker
-from compress_logic import run_compression
+from compress_logic import run_compression, EXECUTION_ENGINES, warm_up_worker_pools, shutdown_worker_pools
 from compress_logic import request_stop as logic_request_stop
+from watch_folder import watch_and_compress
+from dry_run import estimate_compression
+from archives import run_archive_compression, is_archive, count_files_in_archive, collect_archive_channel_groups, \
+    ARCHIVE_WILDCARD
+from target_search import TARGET_OPTION_PREFIX, format_target_option
 from helpers import count_files_in_source, count_files_in_destination, log_to_console, collect_multi_frame_tiff_groups
 
 COMPRESSION_OPTIONS = [
     'Compress with Quality Retention',
+    'Compress with Lossless Bit Depth Reduction',
     'Compress Size x2',
     'Compress Size x4',
     'Compress Size x8',
     'Compress Size x16',
+    'Multi-Resolution x2 x4 x8',
+    'Multi-Resolution x2 x4 x8 x16',
+    'Compress to Target Size',
+    'Compress to Target PSNR',
+    'Compress to Target SSIM',
 ]
+# Hint shown in the target value field for each target option
+TARGET_VALUE_HINTS = {
+    'Size': 'KB per image',
+    'PSNR': 'min PSNR (dB)',
+    'SSIM': 'min SSIM (0-1)',
+}
 
 
 class CompressorApp(wx.Frame):
@@ -33,6 +51,13 @@ class CompressorApp(wx.Frame):
         self.stop_requested = False
         self.instance_of_app = self
         self.should_merge = False
+        self.should_watch = False
+        self.should_verify = False
+        self.source_has_channel_groups = False
+        # Member names of a source archive, from its scan
+        self.source_member_names = None
+        # Set while a source scan runs in the background, cancelling it stops the scan
+        self.scan_cancel_event = None
 
         # Determine if we're running as a bundled executable
         base_path = os.path.dirname(os.path.abspath(__file__))
@@ -61,6 +86,15 @@ class CompressorApp(wx.Frame):
         self.btn_dest.SetBackgroundColour('navy')
         self.btn_dest.SetForegroundColour('white')
         self.btn_dest.SetFont(wx.Font(11, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD))
+        # Zip/tar archives as source or destination, members are streamed without unpacking the archive
+        self.btn_source_archive = buttons.GenButton(self.panel, label='🗜️ Source Archive   ')
+        self.btn_source_archive.SetBackgroundColour('navy')
+        self.btn_source_archive.SetForegroundColour('white')
+        self.btn_source_archive.SetFont(wx.Font(11, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD))
+        self.btn_dest_archive = buttons.GenButton(self.panel, label='🗜️ Destination Archive   ')
+        self.btn_dest_archive.SetBackgroundColour('navy')
+        self.btn_dest_archive.SetForegroundColour('white')
+        self.btn_dest_archive.SetFont(wx.Font(11, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD))
 
         self.btn_start = buttons.GenButton(self.panel, label='▶️ Start Compression', pos=(500, 360))
         self.btn_start.SetBackgroundColour('navy')
@@ -73,6 +107,11 @@ class CompressorApp(wx.Frame):
         self.stop_button.SetFont(wx.Font(11, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD))
         self.stop_button.Disable()
 
+        self.btn_dry_run = buttons.GenButton(self.panel, label='🔍 Estimate (Dry Run)', pos=(800, 360))
+        self.btn_dry_run.SetBackgroundColour('navy')
+        self.btn_dry_run.SetForegroundColour('white')
+        self.btn_dry_run.SetFont(wx.Font(11, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD))
+
         # Add a TextCtrl for console output
         self.console_output = wx.TextCtrl(self.panel, size=(0, 150),
                                           style=wx.TE_MULTILINE | wx.TE_READONLY | wx.TE_RICH)
@@ -88,11 +127,16 @@ class CompressorApp(wx.Frame):
         # Bind the buttons to their respective event handlers
         self.Bind(wx.EVT_BUTTON, self.on_select_source, self.btn_source)
         self.Bind(wx.EVT_BUTTON, self.on_select_destination, self.btn_dest)
+        self.Bind(wx.EVT_BUTTON, self.on_select_source_archive, self.btn_source_archive)
+        self.Bind(wx.EVT_BUTTON, self.on_select_destination_archive, self.btn_dest_archive)
         self.Bind(wx.EVT_BUTTON, self.on_start_compression, self.btn_start)
         self.Bind(wx.EVT_BUTTON, self.request_stop, self.stop_button)
+        self.Bind(wx.EVT_BUTTON, self.on_dry_run, self.btn_dry_run)
 
         # Bind the resize event to the update background function
         self.Bind(wx.EVT_SIZE, self.on_resize)
+        # Shut down the session worker pool when the window closes
+        self.Bind(wx.EVT_CLOSE, self.on_close)
 
         # Create a BoxSizer for vertical layout
         main_sizer = wx.BoxSizer(wx.VERTICAL)
@@ -101,6 +145,8 @@ class CompressorApp(wx.Frame):
         button_sizer = wx.BoxSizer(wx.HORIZONTAL)
         button_sizer.Add(self.btn_source, 0, wx.CENTER | wx.ALL, 10)
         button_sizer.Add(self.btn_dest, 0, wx.CENTER | wx.ALL, 10)
+        button_sizer.Add(self.btn_source_archive, 0, wx.CENTER | wx.ALL, 10)
+        button_sizer.Add(self.btn_dest_archive, 0, wx.CENTER | wx.ALL, 10)
         # Add a Choice widget for compression options
         self.compression_choice = wx.Choice(self.panel, choices=COMPRESSION_OPTIONS)
         self.compression_choice.SetBackgroundColour(wx.Colour('navy'))
@@ -114,6 +160,21 @@ class CompressorApp(wx.Frame):
         choice_label = wx.StaticText(self.panel)
         choice_sizer.Add(choice_label, 0, wx.CENTER | wx.ALL, 5)
         choice_sizer.Add(self.compression_choice, 1, wx.EXPAND | wx.ALL, 5)
+        self.compression_choice.Bind(wx.EVT_CHOICE, self.on_compression_choice)
+
+        # Target value for the 'Compress to Target' options (byte budget or minimum quality), hidden otherwise
+        self.target_value_input = wx.TextCtrl(self.panel, size=(140, -1))
+        self.target_value_input.SetFont(font)
+        choice_sizer.Add(self.target_value_input, 0, wx.EXPAND | wx.ALL, 5)
+        self.target_value_input.Hide()
+
+        # Choice widget for the execution engine (Auto picks threads or processes per workload)
+        self.engine_choice = wx.Choice(self.panel, choices=EXECUTION_ENGINES)
+        self.engine_choice.SetBackgroundColour(wx.Colour('navy'))
+        self.engine_choice.SetForegroundColour(wx.Colour('white'))
+        self.engine_choice.SetSelection(0)
+        self.engine_choice.SetFont(font)
+        choice_sizer.Add(self.engine_choice, 0, wx.EXPAND | wx.ALL, 5)
 
         main_sizer.Add(button_sizer, 0, wx.CENTER)
         main_sizer.Add(choice_sizer, 0, wx.CENTER)
@@ -127,6 +188,7 @@ class CompressorApp(wx.Frame):
         button_sizer_start_stop = wx.BoxSizer(wx.HORIZONTAL)
         button_sizer_start_stop.Add(self.btn_start, 0, wx.ALL, 10)
         button_sizer_start_stop.Add(self.stop_button, 0, wx.ALL, 10)
+        button_sizer_start_stop.Add(self.btn_dry_run, 0, wx.ALL, 10)
         main_sizer.Add(button_sizer_start_stop, 0, wx.CENTER)
 
         # Create a checkbox for merging channels (initially hidden)
@@ -135,6 +197,16 @@ class CompressorApp(wx.Frame):
         self.merge_checkbox.Hide()
         self.merge_checkbox.Bind(wx.EVT_CHECKBOX, self.on_merge_channels)
 
+        # Checkbox for watch mode: keep compressing new files as they land in the Source Directory until Stop
+        self.watch_checkbox = wx.CheckBox(self.panel, label="Watch Source Directory: compress new files as they arrive")
+        main_sizer.Add(self.watch_checkbox, 0, wx.ALL | wx.CENTER, 5)
+        self.watch_checkbox.Bind(wx.EVT_CHECKBOX, self.on_watch_source)
+
+        # Checkbox for decoding every lossless output again and comparing it with the source, recorded in log.txt
+        self.verify_checkbox = wx.CheckBox(self.panel, label="Verify lossless outputs: decode and compare with the source")
+        main_sizer.Add(self.verify_checkbox, 0, wx.ALL | wx.CENTER, 5)
+        self.verify_checkbox.Bind(wx.EVT_CHECKBOX, self.on_verify_outputs)
+
         # Load standard gif icon and loading animation gif
         self.github_icon_path = os.path.join(base_path, 'img', 'github_icon.gif')
         self.github_loading_path = os.path.join(base_path, 'img', 'busy_loading.gif')
@@ -159,9 +231,55 @@ class CompressorApp(wx.Frame):
         self.Centre()
         self.Show(True)
 
+        # Start the worker pool in the background so the first compression does not pay its start-up
+        threading.Thread(target=warm_up_worker_pools, daemon=True).start()
+
+    def on_close(self, event):
+        self.cancel_source_scan()
+        shutdown_worker_pools()
+        event.Skip()
+
     def on_merge_channels(self, event):
         self.should_merge = self.merge_checkbox.GetValue()
 
+    def on_compression_choice(self, event):
+        option = self.compression_choice.GetString(self.compression_choice.GetSelection())
+        if option.startswith(TARGET_OPTION_PREFIX):
+            self.target_value_input.SetHint(TARGET_VALUE_HINTS[option.split(' ')[-1]])
+            self.target_value_input.Show()
+        else:
+            self.target_value_input.Hide()
+        wx.CallAfter(self.panel.Layout)
+
+    def get_compression_option(self):
+        """Selected option, target options get their value appended. None when the target value is invalid."""
+        option = self.compression_choice.GetString(self.compression_choice.GetSelection())
+        if not option.startswith(TARGET_OPTION_PREFIX):
+            return option
+        target_kind = option.split(' ')[-1]
+        try:
+            target_value = float(self.target_value_input.GetValue().strip())
+        except ValueError:
+            return None
+        if target_value <= 0 or (target_kind == 'SSIM' and target_value > 1):
+            return None
+        return format_target_option(target_kind, f"{target_value:g}")
+
+    def on_watch_source(self, event):
+        self.should_watch = self.watch_checkbox.GetValue()
+        # Channels may only arrive later while watching, so merging is always offered
+        self.update_merge_checkbox()
+
+    def on_verify_outputs(self, event):
+        self.should_verify = self.verify_checkbox.GetValue()
+
+    def update_merge_checkbox(self):
+        if self.source_has_channel_groups or self.should_watch:
+            self.merge_checkbox.Show()
+        else:
+            self.merge_checkbox.Hide()
+        wx.CallAfter(self.panel.Layout)
+
     def on_resize(self, event):
         """Reposition the GitHub GIF when the window size changes."""
         frame_width, frame_height = self.GetSize()
@@ -188,14 +306,9 @@ class CompressorApp(wx.Frame):
         """Paint the background image."""
         # Create a device context (DC) used for drawing onto the widget
         dc = wx.PaintDC(self.panel)
-        width, height = self.panel.GetSize()
 
-        # Scale the image to cover the entire panel
-        scaled_image = self.image.Scale(width, height, wx.IMAGE_QUALITY_HIGH)
-        bmp = wx.Bitmap(scaled_image)
-
-        # Draw the bitmap onto the panel
-        dc.DrawBitmap(bmp, 0, 0, True)
+        # Draw the background scaled to cover the entire panel, rescaled only when the size changed
+        dc.DrawBitmap(self.get_background_bitmap(), 0, 0, True)
         # Now draw the custom text
         # Add an explanation label at the top
         explanation_text = (
@@ -208,7 +321,9 @@ class CompressorApp(wx.Frame):
             "⭐Compression Options:\n"
             "   - To Compress with Top-Tier Quality retention use ➡️'Compress with Quality Retention'\n"
             "   - To Compress and Greatly Decrease the Image Size use ➡️ 'Compress Size x2'\nHalves the image dimensions, maintaining aspect ratio.\nThe reduction in file size is notable, and the quality remains largely intact.\n\n"
-            "   - As you increase the compression size (x4, x8, x16), the image size decreases proportionally.\n\nQuality loss becomes more noticeable, especially with 'Compress Size x16'."
+            "   - As you increase the compression size (x4, x8, x16), the image size decreases proportionally.\n\nQuality loss becomes more noticeable, especially with 'Compress Size x16'.\n"
+            "   - 'Compress to Target' finds the smallest reduction that fits a size (KB) or keeps a minimum PSNR/SSIM per image.\n"
+            "   - 'Multi-Resolution' writes every listed size from a single read, each into its own folder (x2, x4, ...)."
         )
         font = wx.Font(10, wx.FONTFAMILY_SWISS, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_HEAVY)
         dc.SetFont(font)
@@ -248,50 +363,104 @@ class CompressorApp(wx.Frame):
             # Needed for file-like interface
             pass
 
-    def update_background(self, event):
-        size = self.GetSize()
-        if not hasattr(self, "last_size") or self.last_size != size:
-            # Resize the image
-            image = wx.Image(self.image_file, wx.BITMAP_TYPE_ANY)
-            image = image.Scale(size[0], size[1], wx.IMAGE_QUALITY_HIGH)
+    def get_background_bitmap(self):
+        size = tuple(self.panel.GetSize())
+        if self.bmp is None or self.last_size != size:
+            # Resize the image, the loaded self.image is reused instead of reading the file again
+            image = self.image.Scale(max(size[0], 1), max(size[1], 1), wx.IMAGE_QUALITY_HIGH)
             self.bmp = wx.Bitmap(image)
             self.last_size = size
+        return self.bmp
 
+    def update_background(self, event):
         event.Skip()  # Ensure other event handlers get the resize event as well
+        # on_paint rescales the cached background for the new size
         self.panel.Refresh()
 
     def on_select_source(self, event):
         dlg = wx.DirDialog(self, "Select the Source Directory", "", wx.DD_DEFAULT_STYLE | wx.DD_DIR_MUST_EXIST)
         if dlg.ShowModal() == wx.ID_OK:
             self.source_directory = dlg.GetPath()
-            (total_files,
-             supported_extensions,
-             unsupported_files_count,
-             unsupported_files
-             ) = count_files_in_source(self.source_directory, self.console_output)
-            grouped_files = collect_multi_frame_tiff_groups(self.source_directory)
-            if grouped_files:
-                self.merge_checkbox.Show()
-                wx.CallAfter(self.panel.Layout)
-            else:
-                self.merge_checkbox.Hide()
-                wx.CallAfter(self.panel.Layout)
-            MSG_SEPARATOR = "========================================\n"
-            MSG_SRC_DIR = f"Source Directory: {self.source_directory}\n"
-            MSG_TOTAL_FILES = f"Total Files in Source Directory: {total_files}"
-            MSG_UNSUPPORTED_FILES = f"[⚠] Unsupported Files in Source Directory: {unsupported_files_count} - {', '.join(unsupported_files)}"
-            MSG_UNSUPPORTED_FILES_WARNING = f"[⚠] Only files with the following extensions will be compressed: {', '.join(supported_extensions)}"
-            MSG_SELECT_SOURCE_WITH_SUP_EXT = "[⚠] Please select a Source Directory with Supported Files\n"
-            log_to_console(self.console_output, MSG_SRC_DIR, None, False)
-            log_to_console(self.console_output, MSG_TOTAL_FILES, None, False)
-            if unsupported_files_count > 0:
-                log_to_console(self.console_output, MSG_UNSUPPORTED_FILES, None, False)
-                log_to_console(self.console_output, MSG_UNSUPPORTED_FILES_WARNING, wx.RED, False)
-            if unsupported_files_count == total_files:
-                log_to_console(self.console_output, MSG_SELECT_SOURCE_WITH_SUP_EXT, wx.RED, False)
-            log_to_console(self.console_output, MSG_SEPARATOR, None, False)
+            self.start_source_scan(self.source_directory)
         dlg.Destroy()
 
+    def on_select_source_archive(self, event):
+        dlg = wx.FileDialog(self, "Select the Source Archive", "", "", ARCHIVE_WILDCARD,
+                            wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
+        if dlg.ShowModal() == wx.ID_OK:
+            self.source_directory = dlg.GetPath()
+            self.start_source_scan(self.source_directory)
+        dlg.Destroy()
+
+    def start_source_scan(self, source_directory):
+        # A new selection replaces any scan still running
+        self.cancel_source_scan()
+        self.scan_cancel_event = threading.Event()
+        self.source_has_channel_groups = False
+        self.source_member_names = None
+        self.update_merge_checkbox()
+        self.btn_start.Disable()
+        self.btn_dry_run.Disable()
+        self.stop_button.Enable()
+        startWorker(self.source_scan_done, self.scan_source,
+                    wargs=(source_directory, self.scan_cancel_event))
+
+    def cancel_source_scan(self):
+        if self.scan_cancel_event:
+            self.scan_cancel_event.set()
+
+    def scan_source(self, source_directory, cancel_event):
+        """Runs on a worker thread, the file list streams to the console while scanning."""
+        if is_archive(source_directory):
+            scan = count_files_in_archive(source_directory, self.console_output, cancel_event.is_set)
+            if scan is None:
+                return source_directory, cancel_event, None, None, None
+            counts, member_names = scan
+            return source_directory, cancel_event, counts, collect_archive_channel_groups(member_names), member_names
+        counts = count_files_in_source(source_directory, self.console_output, cancel_event.is_set)
+        if counts is None:
+            return source_directory, cancel_event, None, None, None
+        grouped_files = collect_multi_frame_tiff_groups(source_directory, cancel_event.is_set)
+        return source_directory, cancel_event, counts, grouped_files, None
+
+    def source_scan_done(self, result):
+        """Handle the results of the source scan thread."""
+        source_directory, cancel_event, counts, grouped_files, member_names = result.get()
+        # A newer scan took over, it reports on its own
+        if cancel_event is not self.scan_cancel_event:
+            return
+        self.scan_cancel_event = None
+        self.btn_start.Enable()
+        self.btn_dry_run.Enable()
+        self.stop_button.Disable()
+        if counts is None or grouped_files is None:
+            MSG_SCAN_CANCELLED = "[⚠] Scanning of the Source Directory was cancelled\n"
+            log_to_console(self.console_output, MSG_SCAN_CANCELLED, wx.RED, False)
+            return
+        (total_files,
+         supported_extensions,
+         unsupported_files_count,
+         unsupported_files
+         ) = counts
+        self.source_has_channel_groups = bool(grouped_files)
+        # The run of a source archive reuses this listing instead of reading the archive again
+        self.source_member_names = member_names
+        self.update_merge_checkbox()
+        MSG_SEPARATOR = "========================================\n"
+        MSG_SRC_DIR = f"Source Directory: {source_directory}\n"
+        MSG_TOTAL_FILES = f"Total Files in Source Directory: {total_files}"
+        MSG_UNSUPPORTED_FILES = f"[⚠] Unsupported Files in Source Directory: {unsupported_files_count} - {', '.join(unsupported_files)}"
+        MSG_UNSUPPORTED_FILES_WARNING = f"[⚠] Only files with the following extensions will be compressed: {', '.join(supported_extensions)}"
+        MSG_SELECT_SOURCE_WITH_SUP_EXT = "[⚠] Please select a Source Directory with Supported Files\n"
+        log_to_console(self.console_output, MSG_SRC_DIR, None, False)
+        log_to_console(self.console_output, MSG_TOTAL_FILES, None, False)
+        if unsupported_files_count > 0:
+            log_to_console(self.console_output, MSG_UNSUPPORTED_FILES, None, False)
+            log_to_console(self.console_output, MSG_UNSUPPORTED_FILES_WARNING, wx.RED, False)
+        if unsupported_files_count == total_files:
+            log_to_console(self.console_output, MSG_SELECT_SOURCE_WITH_SUP_EXT, wx.RED, False)
+        log_to_console(self.console_output, MSG_SEPARATOR, None, False)
+
     def on_select_destination(self, event):
         dlg = wx.DirDialog(self, "Select a Empty Destination Directory", "", wx.DD_DEFAULT_STYLE)
         if dlg.ShowModal() == wx.ID_OK:
@@ -314,6 +483,21 @@ class CompressorApp(wx.Frame):
                 log_to_console(self.console_output, MSG_SEPARATOR, None, False)
         dlg.Destroy()
 
+    def on_select_destination_archive(self, event):
+        dlg = wx.FileDialog(self, "Save the Destination Archive", "", "compressed.zip", ARCHIVE_WILDCARD,
+                            wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+        if dlg.ShowModal() == wx.ID_OK:
+            destination_archive = dlg.GetPath()
+            self.destination_directory = destination_archive if is_archive(destination_archive) \
+                else destination_archive + '.zip'
+            MSG_SEPARATOR = "========================================"
+            MSG_DEST_ARCHIVE = f"Destination Archive: {self.destination_directory}"
+            MSG_DEST_ARCHIVE_INFO = "[*] Compressed files are appended to the archive as they finish."
+            log_to_console(self.console_output, MSG_DEST_ARCHIVE, None, False)
+            log_to_console(self.console_output, MSG_DEST_ARCHIVE_INFO, wx.GREEN, False)
+            log_to_console(self.console_output, MSG_SEPARATOR, None, False)
+        dlg.Destroy()
+
     def on_start_compression(self, event):
         MSG_SOURCE_DIR = 'Missing source directory. Please select a source directory.'
         MSG_DESTINATION_DIR = 'Missing destination directory. Please select a destination directory.'
@@ -321,6 +505,9 @@ class CompressorApp(wx.Frame):
         MSG_SOURCE_DEST_DIF_DISK = 'DETECTED: Source and Destination directories are on different Partition/Disk. App needs Source and Destination on same Partition/Disk'
         MSG_DEST_IS_SUBDIR_OF_SOURCE = 'The destination directory cannot be a subdirectory of the source directory.\n -Try creating a new Empty Folder outside of the Source Directory.\n -Select that new Folder as your Destination Directory'
         MSG_DEST_DIR_NOT_EMPTY = 'The destination directory is not empty. Please select an empty directory or clear the contents of the selected directory before starting the compression.'
+        MSG_TARGET_VALUE_INVALID = 'Please enter a valid target: a size in KB, a PSNR in dB or an SSIM between 0 and 1.'
+        MSG_WATCH_ARCHIVE = 'Watch mode needs a Source and Destination Directory, archives cannot be watched.'
+        uses_archive = is_archive(self.source_directory) or is_archive(self.destination_directory)
         # Check if source directory is not selected
         if not self.source_directory:
             wx.MessageBox(MSG_SOURCE_DIR,
@@ -339,8 +526,14 @@ class CompressorApp(wx.Frame):
                           'Warning', wx.OK | wx.ICON_WARNING)
             return
 
+        # Archive runs go through scratch space, the checks below are about two directories
+        if uses_archive:
+            if self.should_watch:
+                wx.MessageBox(MSG_WATCH_ARCHIVE,
+                              'Warning', wx.OK | wx.ICON_WARNING)
+                return
         # Check for different disks (or partitions)
-        if os.name == 'nt':  # For Windows
+        elif os.name == 'nt':  # For Windows
             if os.path.splitdrive(self.source_directory)[0] != os.path.splitdrive(self.destination_directory)[0]:
                 wx.MessageBox(MSG_SOURCE_DEST_DIF_DISK,
                               'Warning', wx.OK | wx.ICON_WARNING)
@@ -352,37 +545,107 @@ class CompressorApp(wx.Frame):
                 return
 
         # Check if the destination directory is a subdirectory of the source directory
-        if os.path.commonpath([self.source_directory, self.destination_directory]) == os.path.normpath(
+        if not uses_archive and os.path.commonpath([self.source_directory, self.destination_directory]) == os.path.normpath(
                 self.source_directory):
             wx.MessageBox(MSG_DEST_IS_SUBDIR_OF_SOURCE,
                           'Warning', wx.OK | wx.ICON_WARNING)
             return
 
         # Check if the destination directory is not empty
-        if os.listdir(self.destination_directory):
+        if not is_archive(self.destination_directory) and os.listdir(self.destination_directory):
             wx.MessageBox(MSG_DEST_DIR_NOT_EMPTY,
                           'Warning', wx.OK | wx.ICON_WARNING)
             return
 
+        # Check the target value of the 'Compress to Target' options
+        compression_option = self.get_compression_option()
+        if compression_option is None:
+            wx.MessageBox(MSG_TARGET_VALUE_INVALID,
+                          'Warning', wx.OK | wx.ICON_WARNING)
+            return
+
         # Proceed with disabling UI elements and starting the compression
         self.gif_ctrl.Disable()
         self.btn_source.Disable()
         self.btn_dest.Disable()
+        self.btn_source_archive.Disable()
+        self.btn_dest_archive.Disable()
         self.btn_start.Disable()
+        self.btn_dry_run.Disable()
         self.compression_choice.Disable()
+        self.target_value_input.Disable()
+        self.engine_choice.Disable()
         self.stop_button.Enable()
         if not self.merge_checkbox.IsShown():
             self.should_merge = False
         else:
             self.merge_checkbox.Disable()
+        self.watch_checkbox.Disable()
+        self.verify_checkbox.Disable()
         self.stop_requested = False
         # Set the GIF to loading mode
         wx.CallAfter(self.set_gif_animation, 'loading')
         # Force UI update
         self.Refresh()
-        startWorker(self.compression_done, run_compression,
-                    wargs=(self.compression_choice, self.source_directory, self.destination_directory,
-                           self.console_output, self.is_stop_requested, self.should_merge))
+        # Watch mode runs until Stop, then writes the log like a normal run
+        run_function = watch_and_compress if self.should_watch else run_compression
+        run_kwargs = {}
+        if uses_archive:
+            run_function = run_archive_compression
+            run_kwargs = {'member_names': self.source_member_names}
+        startWorker(self.compression_done, run_function,
+                    wargs=(compression_option, self.source_directory, self.destination_directory,
+                           self.console_output, self.is_stop_requested, self.should_merge,
+                           self.engine_choice.GetString(self.engine_choice.GetSelection()), self.should_verify),
+                    wkwargs=run_kwargs)
+
+    def on_dry_run(self, event):
+        MSG_SOURCE_DIR = 'Missing source directory. Please select a source directory.'
+        if not self.source_directory:
+            wx.MessageBox(MSG_SOURCE_DIR,
+                          'Warning', wx.OK | wx.ICON_WARNING)
+            return
+        if is_archive(self.source_directory):
+            wx.MessageBox('The dry run samples a Source Directory, please extract a part of the archive to estimate it.',
+                          'Warning', wx.OK | wx.ICON_WARNING)
+            return
+        # Fixed options are always estimated, a target option only when selected with a valid value
+        compression_options = [option for option in COMPRESSION_OPTIONS if not option.startswith(TARGET_OPTION_PREFIX)]
+        selected_option = self.get_compression_option()
+        if selected_option and selected_option.startswith(TARGET_OPTION_PREFIX):
+            compression_options.append(selected_option)
+
+        self.gif_ctrl.Disable()
+        self.btn_source.Disable()
+        self.btn_dest.Disable()
+        self.btn_source_archive.Disable()
+        self.btn_dest_archive.Disable()
+        self.btn_start.Disable()
+        self.btn_dry_run.Disable()
+        self.compression_choice.Disable()
+        self.target_value_input.Disable()
+        self.engine_choice.Disable()
+        self.merge_checkbox.Disable()
+        self.watch_checkbox.Disable()
+        self.verify_checkbox.Disable()
+        self.stop_button.Enable()
+        self.stop_requested = False
+        should_merge = self.should_merge and self.merge_checkbox.IsShown()
+        wx.CallAfter(self.set_gif_animation, 'loading')
+        self.Refresh()
+        # Every option is estimated, the samples are written to a temporary directory only
+        startWorker(self.dry_run_done, estimate_compression,
+                    wargs=(compression_options, self.source_directory, self.console_output, self.is_stop_requested,
+                           should_merge))
+
+    def dry_run_done(self, result):
+        """Handle the results of the dry run thread."""
+        if result.get() == "STOPPED":
+            MSG_STOPPED = "[⚠] Dry run was stopped by the user.\n"
+            log_to_console(self.console_output, MSG_STOPPED, wx.RED, True)
+        self.set_gif_animation('standard')
+        self.gif_ctrl.Enable()
+        self.enable_controls()
 
     # User request Stop Button
     def is_stop_requested(self):
@@ -390,6 +653,10 @@ class CompressorApp(wx.Frame):
 
     def request_stop(self, event):
         self.stop_button.Disable()
+        # While scanning the Source Directory the Stop button cancels the scan
+        if self.scan_cancel_event:
+            self.cancel_source_scan()
+            return
         logic_request_stop(self.set_stop_requested, self.console_output)
 
     def set_stop_requested(self, value):
@@ -398,11 +665,18 @@ class CompressorApp(wx.Frame):
     def enable_controls(self):
         self.btn_source.Enable()
         self.btn_dest.Enable()
+        self.btn_source_archive.Enable()
+        self.btn_dest_archive.Enable()
         self.btn_start.Enable()
+        self.btn_dry_run.Enable()
         self.compression_choice.Enable()
+        self.target_value_input.Enable()
+        self.engine_choice.Enable()
         self.stop_button.Disable()
         self.stop_requested = False
         self.merge_checkbox.Enable()
+        self.watch_checkbox.Enable()
+        self.verify_checkbox.Enable()
         # Force UI update
         self.Refresh()
 
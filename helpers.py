@@ -1,17 +1,37 @@
+import io
 import os
 import platform
 import re
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import wx
 from PIL import Image, TiffImagePlugin
 
+from bit_depth import is_bit_depth_reduction, narrow_bit_depth, get_stored_sample_type
+from verification import verify_lossless, get_verification_indicator
+
+# Regex to match files ending with _chXX.tif
+CHANNEL_FILE_PATTERN = re.compile(r'(.+)_ch\d\d\.tif$')
+# Channels of one merge group are decoded and resized concurrently, Pillow releases the GIL while doing so
+MERGE_CHANNEL_THREADS = min(8, os.cpu_count() or 1)
+
 
 def is_supported_file(file_path):
     supported_extensions = ['.png', '.jpg', '.jpeg', '.tif', '.tiff', '.webp', '.bmp', '.dib']
     return any(file_path.lower().endswith(ext) for ext in supported_extensions)
 
 
+def save_lzw_tiff(frames, output_path, metadata):
+    # Encoded in memory: on a real file Pillow's libtiff writer closes its dup()ed descriptor twice, and under
+    # threads the second close can hit a file another thread just opened under the same number
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format='TIFF', save_all=True, append_images=frames[1:], compression='tiff_lzw',
+                   tiffinfo=metadata)
+    with open(output_path, 'wb') as output_file:
+        output_file.write(buffer.getbuffer())
+
+
 def extract_frames_with_metadata(img):
     frames = []
     while True:
@@ -59,7 +79,7 @@ def count_files_in_destination(directory):
     return total_files
 
 
-def count_files_in_source(directory, console_output):
+def count_files_in_source(directory, console_output, is_cancel_requested=None):
     supported_extensions = ['.png', '.jpg', '.jpeg', '.tif', '.tiff', '.webp', '.bmp', '.dib']
     total_files = 0
     unsupported_files_count = 0
@@ -67,6 +87,9 @@ def count_files_in_source(directory, console_output):
     log_to_console(console_output, "========================================", None, False)
     for root, _, files in os.walk(directory):
         for file in files:
+            # Scanning runs off the UI thread, a new selection or Stop cancels it
+            if is_cancel_requested and is_cancel_requested():
+                return None
             total_files += 1
             MSG_SUPPORTED_FILES = f'[*] File {total_files}: {file}'
             MSG_UNSUPPORTED_FILES = f'[!] Unsupported File {total_files}: {file}'
@@ -80,21 +103,22 @@ def count_files_in_source(directory, console_output):
     return total_files, supported_extensions, unsupported_files_count, unsupported_files
 
 
-def collect_multi_frame_tiff_groups(directory):
-    def extract_channel_number(filename):
-        match = re.search(r'_ch(\d+)', filename)
-        return int(match.group(1)) if match else -1
+def extract_channel_number(filename):
+    match = re.search(r'_ch(\d+)', filename)
+    return int(match.group(1)) if match else -1
+
 
+def collect_multi_frame_tiff_groups(directory, is_cancel_requested=None):
     def sort_files_by_channel(files):
         return sorted(files, key=extract_channel_number)
-    # Regex to match files ending with _chXX.tif
-    pattern = re.compile(r'(.+)_ch\d\d\.tif$')
     groups = defaultdict(list)
 
     for root, dirs, files in os.walk(directory):
+        if is_cancel_requested and is_cancel_requested():
+            return None
         for filename in files:
             if filename.lower().endswith('.tif'):
-                match = pattern.match(filename)
+                match = CHANNEL_FILE_PATTERN.match(filename)
                 if match:
                     full_path = os.path.join(root, filename)
                     base_name = match.group(1)
@@ -106,46 +130,136 @@ def collect_multi_frame_tiff_groups(directory):
     return grouped_files
 
 
-def resize_image(img, compression_option):
-    factor = int(compression_option.split(' ')[-1][1:])
-    new_width = int(img.width / factor)
-    aspect_ratio = img.height / img.width
+def get_compression_factor(compression_option):
+    return int(compression_option.split(' ')[-1][1:])
+
+
+def is_multi_resolution(compression_option):
+    return compression_option.startswith('Multi-Resolution')
+
+
+def get_pyramid_factors(compression_option):
+    # 'Multi-Resolution x2 x4 x8' -> [2, 4, 8]
+    return sorted(int(token[1:]) for token in compression_option.split(' ') if token.startswith('x') and token[1:].isdigit())
+
+
+def get_resized_dimensions(width, height, factor):
+    new_width = int(width / factor)
+    aspect_ratio = height / width
     new_height = int(aspect_ratio * new_width)
-    resampling_method = Image.Resampling.LANCZOS if img.mode in ["L", "RGB", "RGBA"] else Image.NEAREST
-    return img.resize((new_width, new_height), resampling_method)
+    return new_width, new_height
+
 
+def get_resampling_method(img):
+    return Image.Resampling.LANCZOS if img.mode in ["L", "RGB", "RGBA"] else Image.NEAREST
 
-def merge_tiffs(file_paths, output_path, widths, queue, compression_option):
+
+def get_channel_group_base(filename):
+    # 'sample_ch03.tif' -> 'sample', None when the file is not part of a channel group
+    match = CHANNEL_FILE_PATTERN.match(os.path.basename(filename))
+    return match.group(1) if match else None
+
+
+def resize_image(img, compression_option):
+    factor = get_compression_factor(compression_option)
+    return img.resize(get_resized_dimensions(img.width, img.height, factor), get_resampling_method(img))
+
+
+def build_resolution_pyramid(img, factors):
+    # Each level is downsampled from the previous one, sizes still match what a single 'Compress Size xN' run gives
+    levels = []
+    previous_level = img
+    for factor in sorted(factors):
+        new_size = get_resized_dimensions(img.width, img.height, factor)
+        previous_level = previous_level.resize(new_size, get_resampling_method(img))
+        levels.append(previous_level)
+    return levels
+
+
+def load_channels_in_parallel(file_paths, load_channel):
+    # A few huge groups would otherwise decode their channels one after another on a single core
+    with ThreadPoolExecutor(max_workers=MERGE_CHANNEL_THREADS) as executor:
+        loaded = list(executor.map(load_channel, file_paths))
+    # Assemble in channel order (_ch00, _ch01, ...) whatever order the files were listed in
+    order = sorted(range(len(file_paths)), key=lambda index: extract_channel_number(os.path.basename(file_paths[index])))
+    return [loaded[index] for index in order]
+
+
+def merge_tiffs(file_paths, output_path, widths, queue, compression_option, verify=False):
     initial_size = sum(os.path.getsize(file_path) for file_path in file_paths)
-    frames = []
-    for file_path in file_paths:
+
+    def load_channel(file_path):
         with Image.open(file_path) as img:
             frame = img.copy()
             if 'Compress Size' in compression_option:
                 frame = resize_image(frame, compression_option)
-            frames.append(frame)
+        return frame
+
+    source_frames = frames = load_channels_in_parallel(file_paths, load_channel)
+    if is_bit_depth_reduction(compression_option):
+        with Image.open(file_paths[0]) as img:
+            stored_type = get_stored_sample_type(img)
+        frames = narrow_bit_depth(frames, stored_type)
 
     # Extract metadata from the first frame
     if hasattr(frames[0], "tag_v2"):
         metadata = frames[0].tag_v2
     else:
-        metadata = TiffImagePlugin.ImageFileDirectory_v2()
+        metadata = frames[0].info.get("tag_v2", TiffImagePlugin.ImageFileDirectory_v2())
 
     # Save as a multi-frame TIFF
-    frames[0].save(output_path, save_all=True, append_images=frames[1:], compression='tiff_lzw', tiffinfo=metadata)
+    save_lzw_tiff(frames, output_path, metadata)
+    # Each output frame must match its channel exactly
+    verification = verify_lossless(source_frames, output_path) if verify else None
 
     final_size = os.path.getsize(output_path)
     saved_size = initial_size - final_size
     new_name = os.path.basename(output_path)
     console_entry = format_table_row(
-        ['[+] [Merged]' + new_name, f"Original Size: {bytes_to_mb(initial_size):.2f}MB",
+        ['[+] ' + get_verification_indicator(verification) + '[Merged]' + new_name,
+         f"Original Size: {bytes_to_mb(initial_size):.2f}MB",
          f"Final Size: {bytes_to_mb(final_size):.2f}MB",
          f"Saved: {bytes_to_mb(saved_size):.2f}MB"], widths)
     queue.put(console_entry)
 
+    if verification:
+        return saved_size, initial_size, final_size, new_name, verification
     return saved_size, initial_size, final_size, new_name
 
 
+def merge_tiffs_multi_resolution(file_paths, level_output_paths, widths, queue, compression_option):
+    # level_output_paths: [(factor, output_path)], every channel is decoded once for all the levels
+    initial_size = sum(os.path.getsize(file_path) for file_path in file_paths)
+    factors = [factor for factor, _ in level_output_paths]
+
+    def load_channel(file_path):
+        with Image.open(file_path) as img:
+            frame = img.copy()
+        # Only the pyramid is kept, the full resolution frame is released as soon as the channel is done
+        metadata = frame.tag_v2 if hasattr(frame, "tag_v2") else TiffImagePlugin.ImageFileDirectory_v2()
+        return metadata, build_resolution_pyramid(frame, factors)
+
+    channels = load_channels_in_parallel(file_paths, load_channel)
+    metadata = channels[0][0]
+    # Channel-major pyramids -> one frame list per level
+    level_frames = [[levels[index] for _, levels in channels] for index in range(len(factors))]
+
+    results = []
+    for frames, (factor, output_path) in zip(level_frames, level_output_paths):
+        save_lzw_tiff(frames, output_path, metadata)
+        final_size = os.path.getsize(output_path)
+        saved_size = initial_size - final_size
+        new_name = os.path.join(f"x{factor}", os.path.basename(output_path))
+        console_entry = format_table_row(
+            ['[+] [Merged]' + new_name, f"Original Size: {bytes_to_mb(initial_size):.2f}MB",
+             f"Final Size: {bytes_to_mb(final_size):.2f}MB",
+             f"Saved: {bytes_to_mb(saved_size):.2f}MB"], widths)
+        queue.put(console_entry)
+        results.append((saved_size, initial_size, final_size, new_name))
+
+    return results
+
+
 def get_channel_range(files):
     channel_numbers = []
     for file in files:
@@ -1,3 +1,5 @@
+import argparse
+import sys
 from multiprocessing import freeze_support
 
 from gui import CompressorApp
@@ -13,6 +15,25 @@ def main():
     app.MainLoop()
 
 
+def main_worker(argv):
+    # Headless worker sharing a ledger with other processes/machines pointed at the same source and destination
+    from work_queue import run_worker
+    parser = argparse.ArgumentParser(description="SmartImageShrink distributed worker")
+    parser.add_argument('--worker', action='store_true', required=True)
+    parser.add_argument('--source', required=True, help="Source Directory")
+    parser.add_argument('--destination', required=True, help="Destination Directory")
+    parser.add_argument('--option', default='Compress with Quality Retention', help="Compression option, as in the GUI")
+    parser.add_argument('--merge', action='store_true', help="Group *_chXX.tif channels into multi-frame images")
+    parser.add_argument('--ledger', help="Shared ledger file (default: inside the Destination Directory)")
+    parser.add_argument('--verify', action='store_true', help="Decode every lossless output and compare it with the source")
+    args = parser.parse_args(argv)
+    run_worker(args.source, args.destination, args.option, args.merge, args.ledger,
+               verify_lossless_outputs=args.verify)
+
+
 if __name__ == "__main__":
     freeze_support()
-    main()
+    if '--worker' in sys.argv[1:]:
+        main_worker(sys.argv[1:])
+    else:
+        main()
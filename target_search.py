@@ -0,0 +1,151 @@
+import numpy as np
+from PIL import Image
+
+from helpers import get_resized_dimensions, get_resampling_method
+
+TARGET_OPTION_PREFIX = 'Compress to Target'
+# Scale factors tried by the search, 1 keeps the original dimensions
+CANDIDATE_FACTORS = [1, 1.25, 1.5, 2, 2.5, 3, 4, 6, 8, 12, 16]
+# Size estimates are encoded from a proxy whose longest side is at most this many pixels
+PROXY_MAX_SIDE = 1024
+# Quality is measured on full resolution crops of this size, downsampling would hide the detail that gets lost
+QUALITY_CROP_SIDE = 512
+SSIM_WINDOW = 8
+# Full resolution encodes per file for a byte budget: the search result and at most one fallback factor
+MAX_FULL_RESOLUTION_ENCODES = 2
+
+
+def is_target_mode(compression_option):
+    return compression_option.startswith(TARGET_OPTION_PREFIX)
+
+
+def parse_target(compression_option):
+    # 'Compress to Target Size 500KB' -> ('Size', 500000), 'Compress to Target PSNR 40dB' -> ('PSNR', 40.0),
+    # 'Compress to Target SSIM 0.95' -> ('SSIM', 0.95)
+    target_kind, target_value = compression_option[len(TARGET_OPTION_PREFIX):].split()
+    if target_kind == 'Size':
+        return target_kind, int(float(target_value.upper().rstrip('KB')) * 1000)
+    return target_kind, float(target_value.lower().rstrip('db'))
+
+
+def format_target_option(target_kind, target_value):
+    units = {'Size': 'KB', 'PSNR': 'dB', 'SSIM': ''}
+    return f"{TARGET_OPTION_PREFIX} {target_kind} {target_value}{units[target_kind]}"
+
+
+def get_data_range(img, reference):
+    if img.mode in ('I;16', 'I;16B', 'I;16L', 'I;16N'):
+        return 65535.0
+    if img.mode in ('I', 'F'):
+        return max(float(reference.max() - reference.min()), 1.0)
+    return 255.0
+
+
+def to_array(img):
+    if img.mode in ('1', 'P', 'LA', 'PA'):
+        img = img.convert('RGBA' if 'A' in img.mode else 'RGB')
+    array = np.asarray(img, dtype=np.float64)
+    return array if array.ndim == 3 else array[:, :, np.newaxis]
+
+
+def compute_psnr(reference, candidate, data_range):
+    mse = np.mean((reference - candidate) ** 2)
+    return float('inf') if mse == 0 else float(10 * np.log10(data_range ** 2 / mse))
+
+
+def compute_ssim(reference, candidate, data_range):
+    # Mean SSIM over non-overlapping SSIM_WINDOW x SSIM_WINDOW blocks, vectorized with a block reshape
+    height = reference.shape[0] // SSIM_WINDOW * SSIM_WINDOW
+    width = reference.shape[1] // SSIM_WINDOW * SSIM_WINDOW
+    if not height or not width:
+        return 1.0 if np.array_equal(reference, candidate) else 0.0
+    shape = (height // SSIM_WINDOW, SSIM_WINDOW, width // SSIM_WINDOW, SSIM_WINDOW, reference.shape[2])
+    x = reference[:height, :width].reshape(shape)
+    y = candidate[:height, :width].reshape(shape)
+    mean_x = x.mean(axis=(1, 3))
+    mean_y = y.mean(axis=(1, 3))
+    variance_x = x.var(axis=(1, 3))
+    variance_y = y.var(axis=(1, 3))
+    covariance = (x * y).mean(axis=(1, 3)) - mean_x * mean_y
+    c1 = (0.01 * data_range) ** 2
+    c2 = (0.03 * data_range) ** 2
+    ssim_map = ((2 * mean_x * mean_y + c1) * (2 * covariance + c2)) / \
+               ((mean_x ** 2 + mean_y ** 2 + c1) * (variance_x + variance_y + c2))
+    return float(ssim_map.mean())
+
+
+def get_quality_crops(img):
+    # Center crop plus the centers of the four quadrants, all at full resolution
+    side = min(QUALITY_CROP_SIDE, img.width, img.height)
+    centers = [(img.width // 2, img.height // 2)] + [(img.width * x // 4, img.height * y // 4)
+                                                     for x in (1, 3) for y in (1, 3)]
+    crops = []
+    for center_x, center_y in centers:
+        left = min(max(center_x - side // 2, 0), img.width - side)
+        top = min(max(center_y - side // 2, 0), img.height - side)
+        crops.append(img.crop((left, top, left + side, top + side)))
+    return crops
+
+
+def measure_quality(crops, factor, target_kind):
+    # Downsample like the real pipeline, bring back to full size and compare with the untouched crop
+    scores = []
+    for crop in crops:
+        reference = to_array(crop)
+        small = crop.resize(get_resized_dimensions(crop.width, crop.height, factor), get_resampling_method(crop))
+        restored = to_array(small.resize(crop.size, Image.Resampling.BICUBIC if crop.mode in ("L", "RGB", "RGBA")
+                                         else Image.NEAREST))
+        data_range = get_data_range(crop, reference)
+        if target_kind == 'PSNR':
+            scores.append(compute_psnr(reference, restored, data_range))
+        else:
+            scores.append(compute_ssim(reference, restored, data_range))
+    return min(scores)
+
+
+def is_valid_factor(img, factor):
+    return all(side >= 1 for side in get_resized_dimensions(img.width, img.height, factor))
+
+
+def find_quality_factor(img, target_kind, target_value):
+    # Largest reduction whose worst crop still meets the minimum quality
+    crops = get_quality_crops(img)
+    chosen_factor = 1
+    for factor in CANDIDATE_FACTORS[1:]:
+        if not is_valid_factor(crops[0], factor) or measure_quality(crops, factor, target_kind) < target_value:
+            break
+        chosen_factor = factor
+    return chosen_factor
+
+
+def estimate_sizes(img, encoded_size, frame_count):
+    # factor -> estimated output bytes. Factors at or above the proxy scale are encoded from the proxy at their real
+    # dimensions, smaller factors extrapolate the proxy's bytes per pixel (conservative, larger images compress better)
+    proxy_scale = max(max(img.width, img.height) / PROXY_MAX_SIDE, 1)
+    proxy = img if proxy_scale == 1 else img.resize(get_resized_dimensions(img.width, img.height, proxy_scale),
+                                                    get_resampling_method(img))
+    proxy_bytes_per_pixel = encoded_size(proxy) / (proxy.width * proxy.height)
+    estimates = {}
+    for factor in CANDIDATE_FACTORS:
+        if not is_valid_factor(img, factor):
+            break
+        dimensions = get_resized_dimensions(img.width, img.height, factor)
+        if factor >= proxy_scale:
+            candidate = proxy.resize(dimensions, get_resampling_method(img))
+            estimates[factor] = encoded_size(candidate) * frame_count
+        else:
+            estimates[factor] = proxy_bytes_per_pixel * dimensions[0] * dimensions[1] * frame_count
+    return estimates
+
+
+def find_target_factors(img, compression_option, encoded_size, frame_count=1):
+    """Factors to encode at full resolution, in order: the search result first, then one fallback for a byte budget."""
+    target_kind, target_value = parse_target(compression_option)
+    if target_kind in ('PSNR', 'SSIM'):
+        return [find_quality_factor(img, target_kind, target_value)]
+    estimates = estimate_sizes(img, encoded_size, frame_count)
+    factors = list(estimates)
+    fitting = [factor for factor in factors if estimates[factor] <= target_value]
+    start = factors.index(fitting[0]) if fitting else len(factors) - 1
+    # Estimates come from a proxy, the next factor covers a miss. If that still misses, its output is kept.
+    return factors[start:start + MAX_FULL_RESOLUTION_ENCODES]
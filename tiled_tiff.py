@@ -0,0 +1,319 @@
+import math
+import os
+import struct
+import time
+import zlib
+import numpy as np
+import wx.adv
+from PIL import Image, TiffImagePlugin
+
+from compress_logic import TaskSupervisor, TaskFailure, discard_worker_pool, get_worker_pool, POOL_SIZE
+from helpers import resize_image, format_table_row, bytes_to_mb, log_to_console
+from verification import frames_equal, get_verification_indicator, VERIFICATION_PASSED
+
+# TIFF files at least this large (bytes) are split into tiles / frame ranges and encoded across the whole pool
+SPLIT_FILE_THRESHOLD = 512 * 1000 * 1000
+# Tile side in pixels, TIFF needs a multiple of 16
+TILE_SIZE = 512
+ZLIB_LEVEL = 6
+# Units queued ahead of the pool, bounds the raw pixels held in memory while a huge image is encoded
+MAX_UNITS_AHEAD = POOL_SIZE * 2
+# Frame ranges per worker for stacks, several so a slow range does not leave the other workers idle at the end
+FRAME_RANGES_PER_WORKER = 4
+SPLIT_MODES = ('L', 'LA', 'RGB', 'RGBA', 'I;16', 'I', 'F')
+COMPRESSION_ADOBE_DEFLATE = 8
+PREDICTOR_HORIZONTAL = 2
+# Tags rewritten for the tiled layout, or pointing at data of the source file
+STRUCTURAL_TAGS = {254, 256, 257, 258, 259, 262, 273, 277, 278, 279, 284, 317, 320, 322, 323, 324, 325, 330, 338,
+                   339, 513, 514, 34665, 34853}
+
+
+def is_split_candidate(file_path, compression_option):
+    # Multi-resolution and target options encode several candidates per file and keep the per-file pipeline
+    if not file_path.lower().endswith(('.tif', '.tiff')) or os.path.getsize(file_path) < SPLIT_FILE_THRESHOLD:
+        return False
+    if compression_option != 'Compress with Quality Retention' and 'Compress Size' not in compression_option:
+        return False
+    try:
+        with Image.open(file_path) as img:
+            return img.mode in SPLIT_MODES
+    except Exception:
+        return False  # process_file reports it
+
+
+def get_sample_layout(mode):
+    # (rawmode, photometric, sample format, bits per sample, extra samples, numpy dtype) from Pillow's TIFF writer
+    rawmode, _, photometric, sample_format, bits, extra = TiffImagePlugin.SAVE_INFO[mode]
+    dtype = {8: 'u1', 16: '<u2'}.get(bits[0], '<f4' if sample_format == 3 else '<i4')
+    return rawmode, photometric, sample_format, bits, extra, np.dtype(dtype)
+
+
+def encode_tile_row(raw, width, rows, mode):
+    # raw: 'rows' (<= TILE_SIZE) full-width rows -> deflated tiles left to right, edge tiles zero padded
+    _, _, sample_format, bits, _, dtype = get_sample_layout(mode)
+    samples = np.frombuffer(raw, dtype=dtype).reshape(rows, width, len(bits))
+    columns = math.ceil(width / TILE_SIZE)
+    padded = np.zeros((TILE_SIZE, columns * TILE_SIZE, len(bits)), dtype=dtype)
+    padded[:rows, :width] = samples
+    tiles = []
+    for column in range(columns):
+        tile = padded[:, column * TILE_SIZE:(column + 1) * TILE_SIZE]
+        if sample_format != 3:
+            # Horizontal differencing, integer samples wrap around like the TIFF predictor expects
+            predicted = tile.copy()
+            predicted[:, 1:] -= tile[:, :-1]
+            tile = predicted
+        tiles.append(zlib.compress(tile.tobytes(), ZLIB_LEVEL))
+    return tiles
+
+
+def encode_frame_tiles(frame):
+    rawmode = get_sample_layout(frame.mode)[0]
+    tiles = []
+    for top in range(0, frame.height, TILE_SIZE):
+        rows = min(TILE_SIZE, frame.height - top)
+        raw = frame.crop((0, top, frame.width, top + rows)).tobytes('raw', rawmode)
+        tiles.extend(encode_tile_row(raw, frame.width, rows, frame.mode))
+    return tiles
+
+
+def encode_band(src_path, band_index, raw, width, rows, mode):
+    # Runs in the worker, src_path only names the task for the supervisor
+    return band_index, encode_tile_row(raw, width, rows, mode)
+
+
+def encode_frame_range(src_path, start, stop, compression_option):
+    # Runs in the worker, each worker decodes its own frames straight from the source file
+    frames = []
+    with Image.open(src_path) as img:
+        for index in range(start, stop):
+            img.seek(index)
+            frame = img.copy()
+            if 'Compress Size' in compression_option:
+                frame = resize_image(frame, compression_option)
+            if frame.mode not in SPLIT_MODES:
+                raise ValueError(f"frame {index} has mode {frame.mode}, which cannot be written tiled")
+            frames.append((frame.width, frame.height, frame.mode, encode_frame_tiles(frame)))
+    return start, frames
+
+
+def verify_frame_range(src_path, start, stop, output_path):
+    # Runs in the worker, the frames of the range are decoded from both files and compared one at a time
+    try:
+        with Image.open(src_path) as source, Image.open(output_path) as output:
+            for index in range(start, stop):
+                source.seek(index)
+                output.seek(index)
+                if not frames_equal(source, output):
+                    return f"failed - frame {index} differs from the source"
+    except Exception as e:
+        return f"failed - output cannot be decoded: {e}"
+    return VERIFICATION_PASSED
+
+
+class TiledTiffWriter:
+    """Little-endian classic TIFF, tiles are written as they arrive and the IFDs of all frames at the end."""
+
+    def __init__(self, path):
+        self.file = open(path, 'w+b')
+        self.file.write(b'II*\x00\x00\x00\x00\x00')
+        self.next_ifd_pointer = 4
+
+    def tell(self):
+        offset = self.file.tell()
+        if offset >= 2 ** 32:
+            raise ValueError("output exceeds the 4 GB limit of a classic TIFF")
+        return offset
+
+    def write_tile(self, data):
+        offset = self.tell()
+        self.file.write(data)
+        if len(data) & 1:
+            self.file.write(b'\x00')  # Offsets stay on word boundaries
+        return offset
+
+    def write_ifd(self, ifd):
+        offset = self.tell()
+        data = ifd.tobytes(offset)
+        self.file.write(data)
+        self.tell()
+        self.file.seek(self.next_ifd_pointer)
+        self.file.write(struct.pack('<L', offset))
+        self.file.seek(0, os.SEEK_END)
+        entry_count = struct.unpack('<H', data[:2])[0]
+        self.next_ifd_pointer = offset + 2 + entry_count * 12
+
+    def close(self):
+        self.file.close()
+
+
+def build_tiled_ifd(metadata, width, height, mode, tile_offsets, tile_byte_counts):
+    _, photometric, sample_format, bits, extra, _ = get_sample_layout(mode)
+    ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=b'II')
+    for tag, value in metadata.items():
+        if tag in STRUCTURAL_TAGS or tag not in metadata.tagtype:
+            continue
+        ifd[tag] = value
+        ifd.tagtype[tag] = metadata.tagtype[tag]
+    ifd[256] = width
+    ifd[257] = height
+    ifd[258] = bits
+    ifd[259] = COMPRESSION_ADOBE_DEFLATE
+    ifd[262] = photometric
+    ifd[277] = len(bits)
+    ifd[284] = 1  # Chunky
+    ifd[322] = TILE_SIZE
+    ifd[323] = TILE_SIZE
+    ifd[324] = tuple(tile_offsets)
+    ifd[325] = tuple(tile_byte_counts)
+    if sample_format != 3:
+        ifd[317] = PREDICTOR_HORIZONTAL
+    if sample_format != 1:
+        ifd[339] = (sample_format,) * len(bits)
+    if extra:
+        ifd[338] = extra
+    return ifd
+
+
+def run_units(supervisor, unit_tasks, unit_function, on_unit_done, is_stop_requested, console_output):
+    # Feeds the units to the pool at most MAX_UNITS_AHEAD ahead, unit_tasks is consumed lazily
+    def wait(max_in_flight):
+        while len(supervisor.in_flight) > max_in_flight:
+            if is_stop_requested():
+                return False
+            supervisor.poll()
+            for failure in supervisor.pop_unreported_failures():
+                log_to_console(console_output, f"[✖] {failure.name} - {failure.error}", wx.RED, True)
+            time.sleep(0.05)
+        return True
+
+    supervisor.on_task_done = on_unit_done
+    for task in unit_tasks:
+        if not wait(MAX_UNITS_AHEAD):
+            return False
+        supervisor.submit(unit_function, task)
+    return wait(0)
+
+
+def verify_split_output(supervisor, src_path, output_path, frame_count, is_stop_requested, console_output):
+    # (completed, outcome), the frame ranges of the output are verified across the pool like they were encoded
+    with Image.open(output_path) as output:
+        output_frame_count = getattr(output, 'n_frames', 1)
+    if output_frame_count != frame_count:
+        return True, f"failed - output has {output_frame_count} frames, source {frame_count}"
+    range_size = math.ceil(frame_count / (POOL_SIZE * FRAME_RANGES_PER_WORKER))
+    range_tasks = ((src_path, start, min(start + range_size, frame_count), output_path)
+                   for start in range(0, frame_count, range_size))
+    outcomes = []
+
+    def on_range_verified(task, result):
+        outcomes.append(f"failed - {result.error}" if isinstance(result, TaskFailure) else result)
+
+    completed = run_units(supervisor, range_tasks, verify_frame_range, on_range_verified, is_stop_requested,
+                          console_output)
+    failures = [outcome for outcome in outcomes if outcome != VERIFICATION_PASSED]
+    return completed, failures[0] if failures else VERIFICATION_PASSED
+
+
+def process_split_file(src_path, dest_path_new_name, compression_option, widths, console_output, is_stop_requested,
+                       execution_engine='Auto', verify=False):
+    """process_file for one huge TIFF: tiles (single plane) or frame ranges (stacks) are encoded across the pool."""
+    with Image.open(src_path) as img:
+        frame_count = getattr(img, 'n_frames', 1)
+        metadata = img.tag_v2
+    # Bands of a single plane are cut from the image decoded here, threads encode them without copying the pixels
+    # (zlib and NumPy release the GIL). Frame ranges are decoded by the workers themselves.
+    engine = execution_engine if execution_engine in ('Processes', 'Threads') else \
+        ('Threads' if frame_count == 1 else 'Processes')
+    get_worker_pool(engine)
+    supervisor = TaskSupervisor(engine)
+    writer = TiledTiffWriter(dest_path_new_name)
+    frames = {}  # frame index -> (width, height, mode, tile offsets, tile byte counts)
+    failures = []
+    verification = None
+
+    def write_tiles(tiles):
+        return [writer.write_tile(tile) for tile in tiles], [len(tile) for tile in tiles]
+
+    try:
+        if frame_count == 1:
+            with Image.open(src_path) as img:
+                img.load()
+                plane = resize_image(img, compression_option) if 'Compress Size' in compression_option else img
+                rawmode = get_sample_layout(plane.mode)[0]
+                band_count = math.ceil(plane.height / TILE_SIZE)
+                band_tiles = {}
+                log_to_console(console_output, f"[*] Encoding {os.path.basename(src_path)} as {band_count} rows of "
+                                               f"{TILE_SIZE}px tiles across the pool", None, True)
+
+                def band_tasks():
+                    for band_index in range(band_count):
+                        top = band_index * TILE_SIZE
+                        rows = min(TILE_SIZE, plane.height - top)
+                        raw = plane.crop((0, top, plane.width, top + rows)).tobytes('raw', rawmode)
+                        yield src_path, band_index, raw, plane.width, rows, plane.mode
+
+                def on_band_done(task, result):
+                    if isinstance(result, TaskFailure):
+                        failures.append(result)
+                    else:
+                        band_tiles[result[0]] = write_tiles(result[1])
+
+                completed = run_units(supervisor, band_tasks(), encode_band, on_band_done, is_stop_requested,
+                                      console_output)
+                if completed and not failures:
+                    # Tiles are listed row by row, whatever order the bands finished in
+                    offsets = [offset for band in range(band_count) for offset in band_tiles[band][0]]
+                    byte_counts = [count for band in range(band_count) for count in band_tiles[band][1]]
+                    frames[0] = (plane.width, plane.height, plane.mode, offsets, byte_counts)
+        else:
+            range_size = math.ceil(frame_count / (POOL_SIZE * FRAME_RANGES_PER_WORKER))
+            log_to_console(console_output, f"[*] Encoding the {frame_count} frames of {os.path.basename(src_path)} in "
+                                           f"ranges of {range_size} across the pool", None, True)
+            range_tasks = ((src_path, start, min(start + range_size, frame_count), compression_option)
+                           for start in range(0, frame_count, range_size))
+
+            def on_range_done(task, result):
+                if isinstance(result, TaskFailure):
+                    failures.append(result)
+                    return
+                start, encoded_frames = result
+                for index, (width, height, mode, tiles) in enumerate(encoded_frames, start):
+                    frames[index] = (width, height, mode) + write_tiles(tiles)
+
+            completed = run_units(supervisor, range_tasks, encode_frame_range, on_range_done, is_stop_requested,
+                                  console_output)
+
+        if completed and not failures:
+            for index in range(frame_count):
+                writer.write_ifd(build_tiled_ifd(metadata, *frames[index]))
+            writer.close()
+            if verify:
+                completed, verification = verify_split_output(supervisor, src_path, dest_path_new_name, frame_count,
+                                                              is_stop_requested, console_output)
+    except Exception as e:
+        completed = True
+        failures.append(TaskFailure(src_path, f"{type(e).__name__}: {e}"))
+    finally:
+        writer.close()
+        supervisor.close()
+
+    if not completed:
+        discard_worker_pool(engine)
+        return "STOPPED"
+    if failures:
+        os.remove(dest_path_new_name)
+        return TaskFailure(src_path, failures[0].error)
+
+    initial_size = os.path.getsize(src_path)
+    final_size = os.path.getsize(dest_path_new_name)
+    new_name = os.path.basename(dest_path_new_name)
+    saved_size = initial_size - final_size if initial_size > final_size else 0
+    console_entry = format_table_row(
+        ['[+] ' + get_verification_indicator(verification) + new_name, f"Original Size: {bytes_to_mb(initial_size):.2f}MB",
+         f"Final Size: {bytes_to_mb(final_size):.2f}MB",
+         f"Saved: {bytes_to_mb(saved_size):.2f}MB"], widths)
+    log_to_console(console_output, console_entry, wx.GREEN, True)
+    if verification:
+        return saved_size, initial_size, final_size, new_name, verification
+    return saved_size, initial_size, final_size, new_name
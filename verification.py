@@ -0,0 +1,64 @@
+import numpy as np
+from PIL import Image
+
+from bit_depth import BIT_DEPTH_REDUCTION_OPTION
+
+# Options whose outputs must decode to exactly the source pixels
+LOSSLESS_OPTIONS = ('Compress with Quality Retention', 'Compress with No Data Loss', BIT_DEPTH_REDUCTION_OPTION)
+VERIFICATION_PASSED = "passed"
+
+
+def is_lossless_option(compression_option):
+    return compression_option in LOSSLESS_OPTIONS
+
+
+def is_verification_failure(verification):
+    return bool(verification) and verification.startswith("failed")
+
+
+def get_verification_indicator(verification):
+    # Log/console prefix, empty when verification was not requested
+    if not verification:
+        return ""
+    if verification == VERIFICATION_PASSED:
+        return "[Verified]"
+    return "[NOT VERIFIED]" if is_verification_failure(verification) else "[Not checked]"
+
+
+def get_comparable_samples(frame):
+    # Palette indices may be reordered by the PNG optimizer, the colors they stand for may not
+    if frame.mode in ('P', 'PA'):
+        frame = frame.convert('RGBA')
+    return np.asarray(frame)
+
+
+def frames_equal(source_frame, output_frame):
+    if source_frame.size != output_frame.size:
+        return False
+    source_samples = get_comparable_samples(source_frame)
+    output_samples = get_comparable_samples(output_frame)
+    # Values, not types: bit depth reduction stores the same values in a narrower type
+    return source_samples.shape == output_samples.shape and np.array_equal(source_samples, output_samples)
+
+
+def verify_lossless(source_frames, output_path):
+    """Decode output_path frame by frame and compare it with the source frames still in memory."""
+    if output_path.lower().endswith(('.jpg', '.jpeg')):
+        return "skipped - JPEG is re-encoded"
+    try:
+        with Image.open(output_path) as output:
+            for index, source_frame in enumerate(source_frames):
+                try:
+                    output.seek(index)
+                except EOFError:
+                    return f"failed - output has {index} frames, source {len(source_frames)}"
+                if not frames_equal(source_frame, output):
+                    return f"failed - frame {index} differs from the source"
+            try:
+                output.seek(len(source_frames))
+                return f"failed - output has more than {len(source_frames)} frames"
+            except EOFError:
+                pass
+    except Exception as e:
+        return f"failed - output cannot be decoded: {e}"
+    return VERIFICATION_PASSED
@@ -0,0 +1,239 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import time
+from queue import Empty
+import wx.adv
+
+from compress_logic import get_worker_pool, get_function_exec, create_compression_tasks, get_output_roots, \
+    create_log_entries, drain_queue, TaskSupervisor, quarantined_sources
+from helpers import is_supported_file, get_channel_group_base, log_to_console, create_log_file
+
+# A file is compressed once its size and modification time stopped changing for this long (seconds)
+FILE_SETTLE_SECONDS = 3
+# A channel group is merged once every member settled and no new _chXX file arrived for this long (seconds)
+GROUP_SETTLE_SECONDS = 30
+# Rescan interval without inotify, and safety rescan interval with inotify (seconds)
+POLL_INTERVAL = 2
+IDLE_RESCAN_SECONDS = 60
+# Events of a bulk copy are coalesced, the source tree is rescanned at most once per this many seconds
+MIN_RESCAN_SECONDS = 1
+
+# inotify(7) event mask: files appearing or finished. Writes in progress are not watched, every write would
+# trigger a rescan, files still growing are rescanned every POLL_INTERVAL until they settle anyway.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+
+class InotifyWatcher:
+    """Wakes the watch loop as soon as something changes under the watched directories (Linux only)."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watched_directories = set()
+
+    def add_directory(self, directory):
+        if directory in self.watched_directories:
+            return
+        if self.libc.inotify_add_watch(self.fd, os.fsencode(directory), INOTIFY_MASK) >= 0:
+            self.watched_directories.add(directory)
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        # Only the wake-up matters, the next scan finds out what changed
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback for macOS/Windows or when inotify is unavailable, the watch loop rescans every POLL_INTERVAL."""
+
+    def add_directory(self, directory):
+        pass
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return False
+
+    def close(self):
+        pass
+
+
+def create_directory_watcher():
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher()
+
+
+def wait_for_changes(watcher, timeout, is_stop_requested):
+    # Sliced so Stop is noticed within half a second
+    deadline = time.monotonic() + timeout
+    while not is_stop_requested():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if watcher.wait(min(0.5, remaining)):
+            return True
+    return False
+
+
+def scan_source_directory(source_directory, watcher):
+    snapshot = {}
+    unsupported_files = set()
+    for root, _, files in os.walk(source_directory):
+        watcher.add_directory(root)
+        for file in files:
+            file_path = os.path.join(root, file)
+            if not is_supported_file(file_path):
+                unsupported_files.add(file)
+                continue
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue  # Removed or renamed since os.walk listed it
+            snapshot[file_path] = (stat.st_size, stat.st_mtime)
+    return snapshot, unsupported_files
+
+
+def watch_and_compress(compression_option, source_directory, destination_directory, console_output, is_stop_requested,
+                       should_merge, execution_engine='Auto', verify_lossless_outputs=False):
+    widths = [95, 20, 20, 20]  # Column widths
+    header = ["File Name", "Original Size (MB)", "New Size (MB)", "Saved Size (MB)"]
+    # Files arrive one by one over hours, the process pool keeps a huge stack from blocking the UI thread's GIL
+    engine = 'Threads' if execution_engine == 'Threads' else 'Processes'
+    queue = get_worker_pool(engine)[1]
+    drain_queue(queue)
+    quarantined_sources.clear()
+    # Timeouts, crash retries and quarantine, a corrupt file must not end a session that runs for hours
+    supervisor = TaskSupervisor(engine)
+    watcher = create_directory_watcher()
+
+    MSG_START_WATCH = (f"[▶] Watching {source_directory} with: {compression_option}!\n"
+                       f"[*] New files are compressed once fully written. Press Stop to end the session.\n")
+    log_to_console(console_output, MSG_START_WATCH, None, True)
+
+    last_seen = {}  # file path -> (size, mtime, time of the last change)
+    submitted = set()
+    channel_groups = {}  # (directory, base name) -> {'files': set, 'last_arrival': time}
+    unsupported_files = set()
+
+    def submit(files, merge):
+        # Mirror the directory of the new file in the destination tree(s)
+        rel_dir = os.path.relpath(os.path.dirname(files[0][0] if merge else files[0]), source_directory)
+        for output_root in get_output_roots(destination_directory, compression_option):
+            os.makedirs(os.path.join(output_root, rel_dir), exist_ok=True)
+        tasks = create_compression_tasks(files, source_directory, destination_directory, compression_option, queue,
+                                         widths, merge=merge, verify=verify_lossless_outputs)
+        function_exec = get_function_exec(compression_option, merge)
+        for task in tasks:
+            supervisor.submit(function_exec, task)
+
+    try:
+        while True:
+            stop_requested = is_stop_requested()
+            now = time.monotonic()
+            snapshot, new_unsupported_files = scan_source_directory(source_directory, watcher)
+            unsupported_files |= new_unsupported_files
+
+            ready_files = []
+            unsettled_group_keys = set()  # Channel groups with a member still being written
+            for file_path, (size, mtime) in snapshot.items():
+                if file_path in submitted:
+                    continue
+                previous = last_seen.get(file_path)
+                if previous is None or previous[:2] != (size, mtime) or now - previous[2] < FILE_SETTLE_SECONDS:
+                    if previous is None or previous[:2] != (size, mtime):
+                        last_seen[file_path] = (size, mtime, now)
+                    # Still being written
+                    base_name = get_channel_group_base(file_path) if should_merge else None
+                    if base_name is not None:
+                        unsettled_group_keys.add((os.path.dirname(file_path), base_name))
+                    continue
+                ready_files.append(file_path)
+
+            # Every file is compressed on its own right away like in a batch run, channel files are merged on top
+            for file_path in ready_files:
+                submitted.add(file_path)
+                submit([file_path], merge=False)
+                base_name = get_channel_group_base(file_path) if should_merge else None
+                if base_name is None:
+                    continue
+                group = channel_groups.setdefault((os.path.dirname(file_path), base_name),
+                                                  {'files': set(), 'last_arrival': now})
+                if file_path not in group['files']:
+                    group['files'].add(file_path)
+                    group['last_arrival'] = now
+
+            # Merge a channel group once its members stopped arriving, or when the session ends
+            for group_key, group in list(channel_groups.items()):
+                if group_key in unsettled_group_keys and not stop_requested:
+                    continue
+                if now - group['last_arrival'] < GROUP_SETTLE_SECONDS and not stop_requested:
+                    continue
+                files = sorted(group['files'])
+                del channel_groups[group_key]
+                if len(files) > 1:
+                    submit([files], merge=True)
+
+            drain_progress_messages(queue, console_output)
+            report_failures(supervisor, console_output)
+            if stop_requested:
+                break
+            timeout = POLL_INTERVAL if isinstance(watcher, PollingWatcher) or last_seen.keys() - submitted \
+                or channel_groups or supervisor.in_flight else IDLE_RESCAN_SECONDS
+            wait_for_changes(watcher, timeout, is_stop_requested)
+            # Events that arrive meanwhile wake the next wait at once, so a burst costs one rescan per interval
+            wait_for_changes(PollingWatcher(), now + MIN_RESCAN_SECONDS - time.monotonic(), is_stop_requested)
+    finally:
+        watcher.close()
+
+    # Session ended: let the submitted files finish before writing the log
+    try:
+        while supervisor.in_flight:
+            drain_progress_messages(queue, console_output)
+            report_failures(supervisor, console_output)
+            time.sleep(0.5)
+    finally:
+        supervisor.close()
+    drain_progress_messages(queue, console_output)
+    report_failures(supervisor, console_output)
+    skipped_files = sorted(unsupported_files)
+    log_entries, num_files_processed, total_saved_size = create_log_entries(supervisor.results, skipped_files, widths)
+    MSG_WATCH_ENDED = f'Watch session ended\n✅Successfully compressed {num_files_processed} images.\n '
+    log_to_console(console_output, MSG_WATCH_ENDED, wx.GREEN, True)
+    log_to_console(console_output, "========================================\n", None, False)
+    return create_log_file(destination_directory, num_files_processed, log_entries, total_saved_size, header, widths)
+
+
+def report_failures(supervisor, console_output):
+    supervisor.poll()
+    for failure in supervisor.pop_unreported_failures():
+        log_to_console(console_output, f"[✖] {failure.name} - {failure.error}", wx.RED, True)
+
+
+def drain_progress_messages(queue, console_output):
+    while True:
+        try:
+            message = queue.get_nowait()
+        except Empty:
+            break
+        log_to_console(console_output, message, wx.GREEN, True)
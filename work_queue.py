@@ -0,0 +1,229 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from queue import Empty
+
+from compress_logic import get_worker_pool, get_function_exec, create_compression_tasks, copy_source_directory_tree, \
+    get_output_roots, create_log_entries, TaskSupervisor, TaskFailure, POOL_SIZE
+from helpers import is_supported_file, collect_multi_frame_tiff_groups, create_log_file
+
+# Ledger shared by every worker, kept next to the outputs so all nodes see the same file
+LEDGER_FILE_NAME = ".smartimageshrink_ledger.sqlite"
+# A task whose worker stopped renewing its lease for this long (seconds) is handed to another worker
+LEASE_SECONDS = 600
+# Attempts before a task is recorded as failed for good
+MAX_ATTEMPTS = 3
+
+
+class WorkLedger:
+    """SQLite ledger of the compression tasks, shared over the filesystem by independent worker processes/machines."""
+
+    def __init__(self, ledger_path):
+        # Autocommit mode, every write below opens its own BEGIN IMMEDIATE transaction
+        self.connection = sqlite3.connect(ledger_path, timeout=120, isolation_level=None)
+        # WAL needs shared memory and does not work over network filesystems
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "task_key TEXT PRIMARY KEY, merge INTEGER, files TEXT, status TEXT DEFAULT 'pending', "
+            "worker TEXT, lease_expires REAL, attempts INTEGER DEFAULT 0, result TEXT, error TEXT)")
+
+    def transaction(self, statements):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            results = [self.connection.execute(sql, parameters) for sql, parameters in statements]
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        return results
+
+    def check_settings(self, settings):
+        # The first worker records the run settings, every other worker must join with the same ones
+        self.transaction([("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", (key, value))
+                          for key, value in settings.items()])
+        for key, value in settings.items():
+            stored = self.connection.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()[0]
+            if stored != value:
+                raise ValueError(f"Ledger was created with {key}={stored!r}, this worker uses {value!r}")
+
+    def seed(self, ledger_tasks):
+        # Idempotent: every worker seeds, the task keys make sure each task exists once
+        self.transaction([("INSERT OR IGNORE INTO tasks (task_key, merge, files) VALUES (?, ?, ?)",
+                           (task_key, int(merge), json.dumps(files))) for task_key, merge, files in ledger_tasks])
+
+    def claim(self, worker_id):
+        now = time.time()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Expired leases on a last attempt mean the task keeps killing its workers
+            self.connection.execute(
+                "UPDATE tasks SET status = 'failed', error = 'worker lost (lease expired)' "
+                "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?", (now, MAX_ATTEMPTS))
+            row = self.connection.execute(
+                "SELECT task_key, merge, files FROM tasks WHERE attempts < ? AND "
+                "(status = 'pending' OR (status = 'running' AND lease_expires < ?)) LIMIT 1",
+                (MAX_ATTEMPTS, now)).fetchone()
+            if row:
+                self.connection.execute(
+                    "UPDATE tasks SET status = 'running', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                    "WHERE task_key = ?", (worker_id, now + LEASE_SECONDS, row[0]))
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        if row:
+            return row[0], bool(row[1]), json.loads(row[2])
+        return None
+
+    def renew(self, task_key, worker_id):
+        self.transaction([("UPDATE tasks SET lease_expires = ? WHERE task_key = ? AND worker = ?",
+                           (time.time() + LEASE_SECONDS, task_key, worker_id))])
+
+    def complete(self, task_key, worker_id, result):
+        # Stored as a list of levels, multi-resolution tasks return one result per level
+        levels = result if isinstance(result, list) else [result]
+        self.transaction([("UPDATE tasks SET status = 'done', result = ? WHERE task_key = ? AND worker = ?",
+                           (json.dumps(levels), task_key, worker_id))])
+
+    def fail(self, task_key, worker_id, error):
+        # Back to pending for another attempt, or failed for good once MAX_ATTEMPTS is reached
+        self.transaction([("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                           "error = ? WHERE task_key = ? AND worker = ?", (MAX_ATTEMPTS, error, task_key, worker_id))])
+
+    def count_unfinished(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'running')").fetchone()[0]
+
+    def claim_log_writer(self):
+        # Exactly one worker writes the merged log
+        cursor = self.transaction([("INSERT OR IGNORE INTO settings (key, value) VALUES ('log_written', '1')", ())])[0]
+        return cursor.rowcount == 1
+
+    def finished_tasks(self):
+        return self.connection.execute(
+            "SELECT task_key, status, result, error FROM tasks WHERE status IN ('done', 'failed') ORDER BY task_key"
+        ).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+def create_ledger_tasks(source_directory, should_merge):
+    # Same tasks as a GUI run: channel groups (when merging), then every supported file on its own.
+    # Paths are relative so nodes can mount the source/destination at different places.
+    ledger_tasks = []
+    if should_merge:
+        for files in collect_multi_frame_tiff_groups(source_directory).values():
+            rel_files = [os.path.relpath(file_path, source_directory) for file_path in files]
+            ledger_tasks.append(("merge:" + rel_files[0], True, rel_files))
+    skipped_files = []
+    for root, _, files in os.walk(source_directory):
+        for file in files:
+            file_path = os.path.join(root, file)
+            if not is_supported_file(file_path):
+                skipped_files.append(file)
+                continue
+            rel_path = os.path.relpath(file_path, source_directory)
+            ledger_tasks.append(("file:" + rel_path, False, [rel_path]))
+    return ledger_tasks, skipped_files
+
+
+def run_worker(source_directory, destination_directory, compression_option, should_merge=False, ledger_path=None,
+               execution_engine='Processes', verify_lossless_outputs=False):
+    """Claim and process tasks from the shared ledger until none are left, start as many as you like per node."""
+    widths = [95, 20, 20, 20]  # Column widths
+    header = ["File Name", "Original Size (MB)", "New Size (MB)", "Saved Size (MB)"]
+    # Absolute paths: task files are joined with source_directory again by create_compression_tasks
+    source_directory = os.path.abspath(source_directory)
+    destination_directory = os.path.abspath(destination_directory)
+    ledger_path = os.path.abspath(ledger_path or os.path.join(destination_directory, LEDGER_FILE_NAME))
+    ledger = WorkLedger(ledger_path)
+    ledger.check_settings({'compression_option': compression_option, 'should_merge': str(bool(should_merge)),
+                           'verify_lossless_outputs': str(bool(verify_lossless_outputs))})
+    ledger_tasks, skipped_files = create_ledger_tasks(source_directory, should_merge)
+    ledger.seed(ledger_tasks)
+    ledger.close()
+    for output_root in get_output_roots(destination_directory, compression_option):
+        copy_source_directory_tree(source_directory, output_root)
+
+    queue = get_worker_pool(execution_engine)[1]
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"[▶] Worker {worker_name} joined {ledger_path} with: {compression_option}")
+
+    def run_slot(slot):
+        # One ledger connection per thread, sqlite3 connections are not shared across threads
+        slot_ledger = WorkLedger(ledger_path)
+        worker_id = f"{worker_name}:{slot}"
+        supervisor = TaskSupervisor(execution_engine)
+        while True:
+            claimed = slot_ledger.claim(worker_id)
+            if claimed is None:
+                break
+            task_key, merge, rel_files = claimed
+            files = [os.path.join(source_directory, rel_file) for rel_file in rel_files]
+            task = create_compression_tasks([files] if merge else files, source_directory, destination_directory,
+                                            compression_option, queue, widths, merge=merge,
+                                            verify=verify_lossless_outputs)[0]
+            supervisor.submit(get_function_exec(compression_option, merge), task)
+            # Keep the lease alive while the task runs, the supervisor gives up on crashed or hung pool workers
+            renewed_at = time.time()
+            while supervisor.in_flight:
+                time.sleep(0.5)
+                supervisor.poll()
+                if supervisor.in_flight and time.time() - renewed_at > LEASE_SECONDS / 3:
+                    slot_ledger.renew(task_key, worker_id)
+                    renewed_at = time.time()
+            result = supervisor.results.pop()
+            supervisor.pop_unreported_failures()
+            if isinstance(result, TaskFailure):
+                print(f"Error processing {task_key}: {result.error}")
+                slot_ledger.fail(task_key, worker_id, result.error)
+            else:
+                slot_ledger.complete(task_key, worker_id, result)
+        supervisor.close()
+        slot_ledger.close()
+
+    slots = [threading.Thread(target=run_slot, args=(slot,), daemon=True) for slot in range(POOL_SIZE)]
+    for slot in slots:
+        slot.start()
+    while any(slot.is_alive() for slot in slots):
+        print_progress_messages(queue)
+        time.sleep(0.5)
+    print_progress_messages(queue)
+
+    # Other workers may still hold leases, the last one to finish writes the merged log
+    ledger = WorkLedger(ledger_path)
+    try:
+        if ledger.count_unfinished() or not ledger.claim_log_writer():
+            # A worker that died holding a task leaves it to the next worker started after its lease expired
+            print(f"[*] Worker {worker_name} has no more tasks to claim, the last worker to finish writes the log")
+            return None
+        results = []
+        failed_entries = []
+        for task_key, status, result, error in ledger.finished_tasks():
+            if status == 'done':
+                results.extend(tuple(level) for level in json.loads(result) if level)
+            else:
+                failed_entries.append(f"[✖] {task_key.split(':', 1)[1]} - failed after {MAX_ATTEMPTS} attempts: {error}")
+        log_entries, num_files_processed, total_saved_size = create_log_entries(results, skipped_files, widths)
+        log_entries.extend(failed_entries)
+        log_file_path = create_log_file(destination_directory, num_files_processed, log_entries, total_saved_size,
+                                        header, widths)
+        print(f"[*] All tasks done, log written to {log_file_path}")
+        return log_file_path
+    finally:
+        ledger.close()
+
+
+def print_progress_messages(queue):
+    # Headless counterpart of the GUI console
+    while True:
+        try:
+            print(queue.get_nowait())
+        except Empty:
+            break